@@ -0,0 +1,75 @@
+import os
+import re
+import time
+from collections import OrderedDict
+
+# Answers to read-only questions, keyed on the normalized prompt plus the
+# context snapshot version the answer was generated from. Any write that
+# touches the snapshot bumps its version, which makes every older entry
+# unreachable; they are dropped as soon as a newer version is seen.
+# Answers that came with tool calls are never cached.
+CACHE_SIZE = int(os.environ.get('AI_CACHE_SIZE', '256'))
+CACHE_TTL_SECONDS = int(os.environ.get('AI_CACHE_TTL_SECONDS', '300'))
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt.lower()).strip(" ?!.")
+
+
+class ResponseCache:
+    def __init__(self, size: int = CACHE_SIZE, ttl: int = CACHE_TTL_SECONDS):
+        self.size = size
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()  # normalized prompt -> (stored_at, reply)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidated": 0}
+
+    def _sync(self, version: int) -> bool:
+        if version > self.version:
+            self.stats["invalidated"] += len(self._entries)
+            self._entries.clear()
+            self.version = version
+        return version == self.version
+
+    def get(self, prompt: str, version: int):
+        key = normalize_prompt(prompt)
+        entry = self._entries.get(key) if self._sync(version) else None
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            self.stats["expired"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, prompt: str, version: int, reply: str):
+        # A reply built from an older snapshot than the cache has seen is already stale
+        if not self._sync(version):
+            return
+        key = normalize_prompt(prompt)
+        self._entries[key] = (time.monotonic(), reply)
+        self._entries.move_to_end(key)
+        self.stats["stores"] += 1
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "size": self.size,
+            "ttl_seconds": self.ttl,
+            "version": self.version,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,50 @@
+import os
+from database import db
+from collection_mirror import CollectionMirror
+
+# Slim copies of every task, user and project kept in memory for the AI prompt.
+# Write paths call invalidate() with the ids they touched; the next read
+# re-fetches just those ids with one $in query per kind and bumps the version.
+# A periodic full reload picks up writes made by other processes. What part of
+# the snapshot ends up in a given prompt is decided by ai_retrieval.py.
+CONTEXT_REFRESH_SECONDS = int(os.environ.get('AI_CONTEXT_REFRESH_SECONDS', '300'))
+
+KINDS = {
+    "tasks": ("task_id", {"_id": 0, "task_id": 1, "title": 1, "description": 1, "status": 1, "priority": 1, "due_date": 1, "project_id": 1, "assigned_to": 1}),
+    "users": ("user_id", {"_id": 0, "user_id": 1, "name": 1, "email": 1}),
+    "projects": ("project_id", {"_id": 0, "project_id": 1, "name": 1, "description": 1, "status": 1}),
+}
+
+
+class ContextSnapshot(CollectionMirror):
+    def __init__(self):
+        super().__init__(KINDS, CONTEXT_REFRESH_SECONDS)
+        self.version = 0
+        self.entities = {kind: {} for kind in KINDS}
+
+    async def _load(self):
+        for kind, (key, projection) in KINDS.items():
+            docs = await db[kind].find({}, projection).to_list(None)
+            self.entities[kind] = {d[key]: d for d in docs}
+
+    async def _patch(self, dirty: dict):
+        for kind, ids in dirty.items():
+            key, projection = KINDS[kind]
+            docs = await db[kind].find({key: {"$in": list(ids)}}, projection).to_list(None)
+            found = {d[key]: d for d in docs}
+            for entity_id in ids:
+                if entity_id in found:
+                    self.entities[kind][entity_id] = found[entity_id]
+                else:
+                    self.entities[kind].pop(entity_id, None)
+
+    def _changed(self):
+        self.version += 1
+
+    async def refresh(self) -> int:
+        """Bring the snapshot up to date and return its version."""
+        await super().refresh()
+        return self.version
+
+
+snapshot = ContextSnapshot()
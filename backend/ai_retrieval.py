@@ -0,0 +1,262 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from ai_context import snapshot
+
+# Picks which tasks, projects and users go into the AI prompt. Entities are
+# ranked against the prompt with BM25 over their names/titles/descriptions,
+# boosted by structured hints (ids mentioned verbatim, "overdue", status
+# words), and packed best-first until the token budget is spent.
+TOKEN_BUDGET = int(os.environ.get('AI_CONTEXT_TOKEN_BUDGET', '1500'))
+DESCRIPTION_CHARS = 200
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TEXT_FIELDS = {
+    "tasks": ("title", "description"),
+    "projects": ("name", "description"),
+    "users": ("name", "email"),
+}
+ID_PATTERN = re.compile(r"\b(?:task|proj|user)_[0-9a-f]{12}\b")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "be", "with",
+    "what", "which", "who", "whom", "how", "me", "my", "i", "you", "it", "this", "that", "do", "does",
+    "can", "please", "all", "any", "show", "list", "tell", "about", "has", "have", "at", "by",
+}
+STATUS_HINTS = {
+    "todo": "todo", "progress": "in_progress", "review": "in_review", "done": "done", "completed": "done",
+}
+OVERDUE_WORDS = {"overdue", "late"}
+UPCOMING_WORDS = {"upcoming", "deadline", "deadlines"}
+UPCOMING_PHRASES = (" due soon ", " this week ")
+HINT_BOOST = 10.0
+RELATED_WEIGHT = 0.5
+# Smallest entry packing can add (a user with a one-letter name); once less
+# than this is left of the budget, nothing else can fit
+MIN_ENTRY_TOKENS = len('{"user_id": "user_000000000000", "name": "x"}') // 4 + 1
+MAX_PACK_MISSES = 50  # entries in a row that didn't fit before packing gives up
+
+
+def tokenize(text: str) -> list:
+    return [w for w in WORD_PATTERN.findall(text.lower()) if w not in STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English/JSON; good enough for budgeting
+    return len(text) // 4 + 1
+
+
+class BM25Index:
+    """Incremental BM25 over the snapshot's entities.
+
+    Snapshot patches replace only the changed entity dicts, so on each new
+    version the index re-tokenizes just the entities whose dict object changed.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._docs = {}       # (kind, id) -> (entity dict, Counter of terms, length)
+        self._df = Counter()
+        self._postings = {}   # term -> set of (kind, id)
+        self._total_length = 0
+
+    def _remove(self, key):
+        _, terms, length = self._docs.pop(key)
+        self._total_length -= length
+        for term in terms:
+            self._df[term] -= 1
+            self._postings[term].discard(key)
+            if not self._df[term]:
+                del self._df[term]
+                del self._postings[term]
+
+    def _add(self, key, kind: str, entity: dict):
+        text = " ".join(str(entity.get(f) or "") for f in TEXT_FIELDS[kind])
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self._docs[key] = (entity, terms, length)
+        self._total_length += length
+        for term in terms:
+            self._df[term] += 1
+            self._postings.setdefault(term, set()).add(key)
+
+    def sync(self, version: int, entities: dict):
+        if version == self.version:
+            return
+        live = set()
+        for kind, items in entities.items():
+            for entity_id, entity in items.items():
+                key = (kind, entity_id)
+                live.add(key)
+                current = self._docs.get(key)
+                if current is not None and current[0] is entity:
+                    continue
+                if current is not None:
+                    self._remove(key)
+                self._add(key, kind, entity)
+        for key in [k for k in self._docs if k not in live]:
+            self._remove(key)
+        self.version = version
+
+    def score(self, query_terms: list) -> Counter:
+        scores = Counter()
+        n = len(self._docs)
+        if not n:
+            return scores
+        avg_length = self._total_length / n or 1
+        for term in set(query_terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key in postings:
+                _, terms, length = self._docs[key]
+                tf = terms[term]
+                scores[key] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+        return scores
+
+
+index = BM25Index()
+
+
+def hint_scores(prompt: str, entities: dict) -> Counter:
+    scores = Counter()
+    # Whole words only, so "translate" or "latest" don't read as "late"
+    words = WORD_PATTERN.findall(prompt.lower())
+    word_set = set(words)
+    phrase_text = f" {' '.join(words)} "
+
+    for entity_id in ID_PATTERN.findall(prompt):
+        for kind, items in entities.items():
+            if entity_id in items:
+                scores[(kind, entity_id)] += HINT_BOOST * 2
+
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    soon_iso = (now + timedelta(days=7)).isoformat()
+    overdue = bool(word_set & OVERDUE_WORDS)
+    upcoming = bool(word_set & UPCOMING_WORDS) or any(p in phrase_text for p in UPCOMING_PHRASES)
+    statuses = {status for word, status in STATUS_HINTS.items() if word in word_set}
+    if not (overdue or upcoming or statuses):
+        return scores
+
+    for task_id, task in entities["tasks"].items():
+        due = task.get("due_date")
+        open_task = task.get("status") != "done"
+        if overdue and due and open_task and due < now_iso:
+            scores[("tasks", task_id)] += HINT_BOOST
+        if upcoming and due and open_task and now_iso <= due <= soon_iso:
+            scores[("tasks", task_id)] += HINT_BOOST
+        if task.get("status") in statuses:
+            scores[("tasks", task_id)] += HINT_BOOST / 2
+    return scores
+
+
+def expand_related(scores: Counter, entities: dict) -> Counter:
+    # A matched user pulls in their tasks; a matched task pulls in its project and
+    # assignee. Each related entity gets its single best contribution, not the
+    # sum over every match, so a project with many matching tasks still ranks
+    # below those tasks.
+    related = Counter()
+    tasks = entities["tasks"]
+
+    def relate(key, s):
+        related[key] = max(related[key], s * RELATED_WEIGHT)
+
+    matched_users = {eid: s for (kind, eid), s in scores.items() if kind == "users"}
+    if matched_users:
+        for task_id, task in tasks.items():
+            if task.get("assigned_to") in matched_users:
+                relate(("tasks", task_id), matched_users[task["assigned_to"]])
+    for (kind, entity_id), s in scores.items():
+        if kind != "tasks" or entity_id not in tasks:
+            continue
+        task = tasks[entity_id]
+        if task.get("project_id"):
+            relate(("projects", task["project_id"]), s)
+        if task.get("assigned_to"):
+            relate(("users", task["assigned_to"]), s)
+    return related
+
+
+_summary = (None, None)  # (snapshot version, summary) of the last summarize()
+
+
+def summarize(version: int, entities: dict) -> dict:
+    # Aggregates the model can't derive from a sample, e.g. "who has the most tasks?".
+    # Computed once per snapshot version; the periodic reload keeps "overdue" current.
+    global _summary
+    if _summary[0] == version:
+        return _summary[1]
+    tasks = entities["tasks"].values()
+    users = entities["users"]
+    now_iso = datetime.now(timezone.utc).isoformat()
+    workload = Counter(t["assigned_to"] for t in tasks if t.get("assigned_to") and t.get("status") != "done")
+    summary = {
+        "total_tasks": len(entities["tasks"]),
+        "total_projects": len(entities["projects"]),
+        "total_users": len(users),
+        "tasks_by_status": dict(Counter(t.get("status") for t in tasks)),
+        "overdue_tasks": sum(1 for t in tasks if t.get("due_date") and t["due_date"] < now_iso and t.get("status") != "done"),
+        "open_tasks_by_assignee": [
+            {"user_id": uid, "name": users.get(uid, {}).get("name"), "open_tasks": n}
+            for uid, n in workload.most_common(10)
+        ],
+    }
+    _summary = (version, summary)
+    return summary
+
+
+def compact(entity: dict) -> dict:
+    doc = {k: v for k, v in entity.items() if v not in (None, "")}
+    if len(doc.get("description", "")) > DESCRIPTION_CHARS:
+        doc["description"] = doc["description"][:DESCRIPTION_CHARS] + "…"
+    return doc
+
+
+async def build_context(prompt: str, budget: int = TOKEN_BUDGET) -> dict:
+    """Return {"version", "context", "tokens", "selected"} for this prompt."""
+    version = await snapshot.refresh()
+    return select_context(prompt, version, snapshot.entities, budget)
+
+
+def select_context(prompt: str, version: int, entities: dict, budget: int = TOKEN_BUDGET) -> dict:
+    index.sync(version, entities)
+
+    scores = index.score(tokenize(prompt))
+    scores.update(hint_scores(prompt, entities))
+    scores.update(expand_related(scores, entities))
+    ranked = [key for key, s in scores.most_common() if s > 0]
+    if not ranked:
+        # Nothing matched: fall back to a plain sample so general questions still get data
+        ranked = [(kind, eid) for kind, items in entities.items() for eid in items]
+
+    context = {"summary": summarize(version, entities), "tasks": [], "projects": [], "users": []}
+    used = estimate_tokens(json.dumps(context, default=str))
+    misses = 0
+    for kind, entity_id in ranked:
+        if budget - used < MIN_ENTRY_TOKENS or misses >= MAX_PACK_MISSES:
+            break
+        entity = entities[kind].get(entity_id)
+        if entity is None:
+            continue
+        doc = compact(entity)
+        cost = estimate_tokens(json.dumps(doc, default=str))
+        if used + cost > budget:
+            # A smaller entry further down may still fit
+            misses += 1
+            continue
+        misses = 0
+        context[kind].append(doc)
+        used += cost
+
+    return {
+        "version": version,
+        "context": json.dumps(context, default=str),
+        "tokens": used,
+        "selected": sum(len(context[k]) for k in ("tasks", "projects", "users")),
+    }
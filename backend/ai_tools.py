@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from pymongo import InsertOne, UpdateOne
+from database import db
+from models import gen_id
+from ai_context import snapshot
+from helpers import notify_task_assigned
+from loaders import loaders
+
+logger = logging.getLogger(__name__)
+
+# Tools the AI agent can call, and the executor that runs one model turn's
+# worth of calls together: every task, user and project the calls reference is
+# prefetched with one $in query per collection, each call is planned in memory
+# against that data, and the writes go out as one bulk_write per collection.
+# A turn of ten create_task calls therefore costs the same few round trips as one.
+
+TASK_STATUSES = ["todo", "in_progress", "in_review", "done"]
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "update_task_status",
+            "description": "Updates the status of a task.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "task_id": {"type": "string", "description": "The ID of the task to update."},
+                    "status": {"type": "string", "enum": ["todo", "in_progress", "in_review", "done"], "description": "The new status."}
+                },
+                "required": ["task_id", "status"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "create_project",
+            "description": "Create a new project.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "Name of the project."},
+                    "description": {"type": "string", "description": "Project description."}
+                },
+                "required": ["name"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "create_task",
+            "description": "Create a new task.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string", "description": "Task title."},
+                    "description": {"type": "string", "description": "Task description."},
+                    "project_id": {"type": "string", "description": "ID of the project this task belongs to."},
+                    "assigned_to": {"type": "string", "description": "User ID of the assignee (optional)."}
+                },
+                "required": ["title", "project_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "reassign_task",
+            "description": "Reassigns a task to a different user.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "task_id": {"type": "string", "description": "The ID of the task."},
+                    "assigned_to": {"type": "string", "description": "The new assignee's User ID."}
+                },
+                "required": ["task_id", "assigned_to"]
+            }
+        }
+    }
+]
+
+
+class ToolPlan:
+    """Writes and follow-ups planned for one turn of tool calls."""
+
+    def __init__(self, tasks: dict, users: dict, projects: dict):
+        self.tasks, self.users, self.projects = tasks, users, projects
+        self.writes = {"tasks": [], "projects": []}
+        self.touched = {"tasks": set(), "projects": set()}
+        self.assignments = []  # (task, assignee) pairs to notify once committed
+        self.results = []
+
+    def write(self, collection: str, entity_id: str, op):
+        self.writes[collection].append(op)
+        self.touched[collection].add(entity_id)
+
+
+def _plan_update_task_status(plan: ToolPlan, args: dict, now_iso: str) -> tuple:
+    task_id, status = args.get("task_id"), args.get("status")
+    if not task_id or status not in TASK_STATUSES:
+        return False, "Missing task_id or invalid status"
+    task = plan.tasks.get(task_id)
+    if not task:
+        return False, f"Task {task_id} not found"
+    plan.write("tasks", task_id, UpdateOne({"task_id": task_id}, {"$set": {"status": status, "updated_at": now_iso}}))
+    return True, f"Moved task '{task['title']}' to {status}"
+
+
+def _plan_create_project(plan: ToolPlan, args: dict, now_iso: str) -> tuple:
+    if not args.get("name"):
+        return False, "Missing project name"
+    project = {
+        "project_id": gen_id("proj_"),
+        "name": args["name"],
+        "description": args.get("description", ""),
+        "priority": "medium",
+        "status": "planning",
+        "team_members": [],
+        "created_by": "system_ai",
+        "created_at": now_iso,
+        "updated_at": now_iso
+    }
+    plan.write("projects", project["project_id"], InsertOne(project))
+    # Later calls in the same turn may refer to the new project by id
+    plan.projects[project["project_id"]] = project
+    return True, f"Created project '{project['name']}'"
+
+
+def _plan_create_task(plan: ToolPlan, args: dict, now_iso: str) -> tuple:
+    if not args.get("title"):
+        return False, "Missing task title"
+    project = plan.projects.get(args.get("project_id"))
+    assignee = plan.users.get(args.get("assigned_to"))
+    task = {
+        "task_id": gen_id("task_"),
+        "title": args["title"],
+        "description": args.get("description", ""),
+        "project_id": args.get("project_id"),
+        "project_name": project.get("name") if project else "Unknown Project",
+        "assigned_to": args.get("assigned_to"),
+        "assigned_to_name": assignee["name"] if assignee else None,
+        "priority": "medium",
+        "status": "todo",
+        "due_date": None,
+        "created_by": "system_ai",
+        "created_at": now_iso,
+        "updated_at": now_iso
+    }
+    plan.write("tasks", task["task_id"], InsertOne(task))
+    plan.tasks[task["task_id"]] = task
+    if assignee:
+        plan.assignments.append((task, assignee))
+    return True, f"Created task '{task['title']}'"
+
+
+def _plan_reassign_task(plan: ToolPlan, args: dict, now_iso: str) -> tuple:
+    task = plan.tasks.get(args.get("task_id"))
+    assignee = plan.users.get(args.get("assigned_to"))
+    if not task or not assignee:
+        return False, "Task or assignee not found"
+    plan.write("tasks", task["task_id"], UpdateOne(
+        {"task_id": task["task_id"]},
+        {"$set": {"assigned_to": assignee["user_id"], "assigned_to_name": assignee["name"], "updated_at": now_iso}}
+    ))
+    plan.assignments.append((task, assignee))
+    return True, f"Reassigned '{task['title']}' to {assignee['name']}"
+
+
+PLANNERS = {
+    "update_task_status": _plan_update_task_status,
+    "create_project": _plan_create_project,
+    "create_task": _plan_create_task,
+    "reassign_task": _plan_reassign_task,
+}
+
+
+def _parse(tool_calls: list) -> list:
+    parsed = []
+    for name, arguments in tool_calls:
+        try:
+            args = json.loads(arguments or "{}")
+        except json.JSONDecodeError:
+            args = None
+        parsed.append((name, args if isinstance(args, dict) else None))
+    return parsed
+
+
+async def _prefetch(calls: list, lookups) -> tuple:
+    task_ids, user_ids, project_ids = set(), set(), set()
+    for name, args in calls:
+        if not args:
+            continue
+        if name in ("update_task_status", "reassign_task") and args.get("task_id"):
+            task_ids.add(args["task_id"])
+        if name in ("create_task", "reassign_task") and args.get("assigned_to"):
+            user_ids.add(args["assigned_to"])
+        if name == "create_task" and args.get("project_id"):
+            project_ids.add(args["project_id"])
+
+    async def fetch(loader, ids: set) -> dict:
+        docs = await loader.load_many(ids)
+        return {d[loader.key]: d for d in docs if d}
+
+    return await asyncio.gather(
+        fetch(lookups.tasks, task_ids),
+        fetch(lookups.users, user_ids),
+        fetch(lookups.projects, project_ids),
+    )
+
+
+async def execute_tool_calls(tool_calls, progress=None) -> list:
+    """Run one turn of (name, arguments_json) tool calls. Returns a
+    {"tool", "ok", "summary"} result per call, in order; if given,
+    progress(result) is called for each once its write has been committed."""
+    calls = _parse(tool_calls)
+    lookups = loaders()
+    tasks, users, projects = await _prefetch(calls, lookups)
+    plan = ToolPlan(tasks, users, projects)
+    now_iso = datetime.now(timezone.utc).isoformat()
+
+    for name, args in calls:
+        planner = PLANNERS.get(name)
+        if planner is None:
+            ok, summary = False, f"Unknown tool {name}"
+        elif args is None:
+            ok, summary = False, "Invalid arguments"
+        else:
+            ok, summary = planner(plan, args, now_iso)
+        plan.results.append({"tool": name, "ok": ok, "summary": summary})
+
+    # Ordered, so two calls touching the same task apply in the order the model gave them
+    await asyncio.gather(*(
+        db[collection].bulk_write(ops, ordered=True)
+        for collection, ops in plan.writes.items() if ops
+    ))
+    for collection, ids in plan.touched.items():
+        snapshot.invalidate(collection, *ids)
+        getattr(lookups, collection).clear(*ids)
+
+    if progress:
+        for result in plan.results:
+            progress(result)
+
+    if plan.assignments:
+        outcomes = await asyncio.gather(*(
+            notify_task_assigned(task, assignee, "System AI") for task, assignee in plan.assignments
+        ), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                logger.error(f"AI tool notification failed: {outcome}")
+
+    return plan.results
@@ -3,9 +3,12 @@ import bcrypt
 import os
 from datetime import datetime, timezone, timedelta
 from fastapi import Request, HTTPException
+from starlette.requests import HTTPConnection
 from database import db
 
 JWT_SECRET = os.environ.get('JWT_SECRET', 'fallback-secret')
+# Lifetime of the tickets WebSocket and EventSource connections authenticate with
+CONNECTION_TICKET_SECONDS = int(os.environ.get('CONNECTION_TICKET_SECONDS', '60'))
 
 
 def hash_password(password: str) -> str:
@@ -27,6 +30,15 @@ def create_token(user_id: str, email: str, role: str, name: str) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
 
+def create_connection_ticket(user_id: str) -> str:
+    payload = {
+        "user_id": user_id,
+        "purpose": "connection",
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=CONNECTION_TICKET_SECONDS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+
 def decode_token(token: str) -> dict:
     try:
         return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
@@ -62,7 +74,14 @@ async def get_current_user(request: Request) -> dict:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
     token = auth_header.split(" ")[1]
+    return await get_user_from_token(token)
+
+
+async def get_user_from_token(token: str, purpose: str = None) -> dict:
     payload = decode_token(token)
+    # Login tokens carry no purpose, so a connection ticket can't stand in for one or vice versa
+    if payload.get("purpose") != purpose:
+        raise HTTPException(status_code=401, detail="Invalid token")
 
     user = await db.users.find_one(
         {"user_id": payload["user_id"]}, {"_id": 0}
@@ -72,6 +91,16 @@ async def get_current_user(request: Request) -> dict:
     return user
 
 
+async def get_connection_user(connection: HTTPConnection) -> dict:
+    # Browsers cannot set headers on WebSocket or EventSource connections, so
+    # accept a connection ticket as a query param. Query strings end up in
+    # access logs, hence a short-lived ticket rather than the login token.
+    ticket = connection.query_params.get("ticket")
+    if ticket:
+        return await get_user_from_token(ticket, purpose="connection")
+    return await get_current_user(connection)
+
+
 def require_role(allowed_roles: list):
     async def role_checker(request: Request):
         user = await get_current_user(request)
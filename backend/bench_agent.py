@@ -0,0 +1,239 @@
+# Offline benchmark for the AI agent pipeline (handle_ai_logic) against a real
+# Mongo (MONGO_URL), with fake_llm_server replaying bench_agent_replay.json.
+#
+#   python bench_agent.py --tasks 5000 --repeat 5 --latency-ms 300 --token-ms 15
+#   python bench_agent.py --json before.json    # keep the numbers to compare later
+#
+# Seeds a throwaway database (BENCH_DB_NAME, default enterprise_agent_bench)
+# with a deterministic dataset, serves the fake LLM in-process and runs every
+# recorded prompt --repeat times. Reports per prompt: end-to-end latency,
+# context build time, prompt tokens, LLM time, tool execution time and Mongo
+# round-trips. The response cache is cleared before each prompt unless --cache.
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timezone, timedelta
+from pymongo import monitoring
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPLAY_PATH = os.path.join(HERE, "bench_agent_replay.json")
+
+FIRST_NAMES = ["Alice", "Bob", "Priya", "Diego", "Mei", "Omar", "Sara", "Liam", "Yuki", "Noah"]
+LAST_NAMES = ["Chen", "Okafor", "Patel", "Garcia", "Kim", "Haddad", "Jensen", "Novak", "Tanaka", "Silva"]
+PROJECT_NAMES = ["Billing Revamp", "Mobile App Launch", "Data Platform", "Support Portal", "Security Audit",
+                 "Search Relaunch", "Partner API", "Onboarding Flow"]
+VERBS = ["Fix", "Design", "Implement", "Review", "Test", "Document", "Refactor", "Migrate"]
+TOPICS = ["invoice", "login", "dashboard", "export", "onboarding", "search", "notification", "payment",
+          "reporting", "webhook", "permissions", "audit log"]
+NOUNS = ["flow", "page", "endpoint", "job", "emails", "rounding", "filters", "retry logic", "schema", "limits"]
+STATUSES = ["todo", "in_progress", "in_review", "done"]
+PRIORITIES = ["low", "medium", "high", "urgent"]
+
+
+def entity_id(prefix: str, i: int) -> str:
+    # Deterministic ids in the same shape as models.gen_id, so replayed tool calls can name them
+    return f"{prefix}{i:012x}"
+
+
+class RoundTrips(monitoring.CommandListener):
+    IGNORED = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in self.IGNORED:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def build_dataset(seed: int, users: int, projects: int, tasks: int) -> tuple:
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    created = (now - timedelta(days=60)).isoformat()
+
+    user_docs = [{
+        "user_id": entity_id("user_", i),
+        "name": f"{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]}",
+        "email": f"bench{i}@example.com",
+        "role": "admin" if i == 0 else ("manager" if i % 10 == 1 else "employee"),
+        "picture": None,
+        "department": None,
+        "created_at": created,
+    } for i in range(users)]
+
+    project_docs = []
+    for i in range(projects):
+        name = PROJECT_NAMES[i % len(PROJECT_NAMES)]
+        if i >= len(PROJECT_NAMES):
+            name += f" {i // len(PROJECT_NAMES) + 1}"
+        project_docs.append({
+            "project_id": entity_id("proj_", i),
+            "name": name,
+            "description": f"{name} work for the {rng.choice(TOPICS)} and {rng.choice(TOPICS)} areas.",
+            "priority": rng.choice(PRIORITIES),
+            "status": "active",
+            "team_members": [u["user_id"] for u in rng.sample(user_docs, min(5, users))],
+            "created_by": user_docs[0]["user_id"],
+            "created_by_name": user_docs[0]["name"],
+            "created_at": created,
+            "updated_at": created,
+        })
+
+    task_docs = []
+    for i in range(tasks):
+        project = project_docs[i % projects]
+        assignee = rng.choice(user_docs) if rng.random() < 0.9 else None
+        title = f"{rng.choice(VERBS)} {rng.choice(TOPICS)} {rng.choice(NOUNS)}"
+        task_docs.append({
+            "task_id": entity_id("task_", i),
+            "title": title,
+            "description": f"{title} for {project['name']}.",
+            "project_id": project["project_id"],
+            "project_name": project["name"],
+            "assigned_to": assignee["user_id"] if assignee else None,
+            "assigned_to_name": assignee["name"] if assignee else None,
+            "priority": rng.choice(PRIORITIES),
+            "status": rng.choices(STATUSES, weights=[4, 3, 1, 2])[0],
+            "due_date": (now + timedelta(days=rng.randint(-10, 30), hours=rng.randint(0, 23))).isoformat(),
+            "created_by": user_docs[0]["user_id"],
+            "created_at": created,
+            "updated_at": created,
+        })
+    return user_docs, project_docs, task_docs
+
+
+async def seed_database(db, seed: int, users: int, projects: int, tasks: int):
+    user_docs, project_docs, task_docs = build_dataset(seed, users, projects, tasks)
+    for name in ("users", "projects", "tasks", "notifications", "notification_pending", "notification_counters"):
+        await db[name].drop()
+    await db.users.insert_many(user_docs)
+    await db.projects.insert_many(project_docs)
+    for i in range(0, len(task_docs), 1000):
+        await db.tasks.insert_many(task_docs[i:i + 1000])
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def main(args) -> dict:
+    round_trips = RoundTrips()
+    monitoring.register(round_trips)
+
+    # Imported after the environment is set up: these read it at import time
+    import uvicorn
+    import agent_service
+    import fake_llm_server
+    from database import db
+    from llm_client import llm
+    from ai_cache import response_cache
+
+    await seed_database(db, args.seed, args.users, args.projects, args.tasks)
+
+    server = uvicorn.Server(uvicorn.Config(fake_llm_server.app, port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            raise SystemExit(f"fake LLM server could not start on port {args.port}")
+        await asyncio.sleep(0.05)
+
+    # Wrap the pipeline's stages to time them per prompt
+    sample = {}
+
+    def timed(name, func):
+        async def wrapper(*a, **kw):
+            started = time.perf_counter()
+            try:
+                return await func(*a, **kw)
+            finally:
+                sample[name] = sample.get(name, 0.0) + (time.perf_counter() - started) * 1000
+        return wrapper
+
+    agent_service.fetch_system_data = timed("context_ms", agent_service.fetch_system_data)
+    agent_service.execute_tool_calls = timed("tools_ms", agent_service.execute_tool_calls)
+    complete = llm.complete
+
+    async def complete_with_usage(**kwargs):
+        response = await timed("llm_ms", complete)(**kwargs)
+        sample["prompt_tokens"] = response.usage.prompt_tokens
+        return response
+    llm.complete = complete_with_usage
+
+    prompts = [entry["prompt"] for entry in fake_llm_server.REPLAY]
+    results = {prompt: [] for prompt in prompts}
+    try:
+        for iteration in range(args.warmup + args.repeat):
+            for prompt in prompts:
+                if not args.cache:
+                    response_cache.clear()
+                sample.clear()
+                before = round_trips.count
+                started = time.perf_counter()
+                await agent_service.handle_ai_logic(prompt)
+                sample["e2e_ms"] = (time.perf_counter() - started) * 1000
+                sample["db_round_trips"] = round_trips.count - before
+                if iteration >= args.warmup:
+                    results[prompt].append(dict(sample))
+    finally:
+        server.should_exit = True
+        await server_task
+
+    columns = ["e2e_ms", "context_ms", "prompt_tokens", "llm_ms", "tools_ms", "db_round_trips"]
+    report = {}
+    print(f"{'prompt':<44} {'e2e p50':>8} {'e2e p95':>8} {'ctx ms':>7} {'tokens':>7} {'llm ms':>7} {'tool ms':>8} {'db rt':>6}")
+    for prompt, samples in results.items():
+        stats = {}
+        for column in columns:
+            values = [s.get(column, 0.0) for s in samples]
+            stats[column] = {"p50": round(percentile(values, 50), 2), "p95": round(percentile(values, 95), 2),
+                             "mean": round(statistics.mean(values), 2)}
+        report[prompt] = stats
+        print(f"{prompt[:44]:<44} {stats['e2e_ms']['p50']:>8.1f} {stats['e2e_ms']['p95']:>8.1f} "
+              f"{stats['context_ms']['p50']:>7.1f} {stats['prompt_tokens']['mean']:>7.0f} "
+              f"{stats['llm_ms']['p50']:>7.1f} {stats['tools_ms']['p50']:>8.1f} {stats['db_round_trips']['mean']:>6.1f}")
+
+    all_e2e = [s["e2e_ms"] for samples in results.values() for s in samples]
+    print(f"overall e2e p50 {percentile(all_e2e, 50):.1f} ms, p95 {percentile(all_e2e, 95):.1f} ms "
+          f"over {len(all_e2e)} prompts")
+    return {"config": vars(args), "prompts": report}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--cache", action="store_true", help="keep the AI response cache between prompts")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+    if args.users < 12 or args.projects < 2 or args.tasks < 10:
+        parser.error("the replayed prompts need at least 12 users, 2 projects and 10 tasks")
+
+    os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "enterprise_agent_bench")
+    os.environ["FAKE_LLM_REPLAY"] = os.environ.get("FAKE_LLM_REPLAY", REPLAY_PATH)
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["FAKE_LLM_TOKEN_MS"] = str(args.token_ms)
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+
+    report = asyncio.run(main(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,70 @@
+# Measures broker-side cost of chat fan-out: memory per idle connection and
+# publish -> receive latency across every subscriber of a channel.
+#
+#   python bench_chat_fanout.py --connections 10000 --messages 50
+#
+# Each "connection" is what chat_socket holds per client: a Subscription plus
+# a task blocked on it. Socket buffers owned by uvicorn are not included.
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+
+from realtime import Broker
+
+
+async def main(connections: int, messages: int, channels: int):
+    broker = Broker()
+    latencies = []
+
+    async def consumer(sub):
+        while True:
+            raw = await sub.get()
+            latencies.append(time.perf_counter() - json.loads(raw)["sent_at"])
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    subs = [broker.subscribe([f"user:u{i}", f"chat:ch{i % channels}"]) for i in range(connections)]
+    tasks = [asyncio.create_task(consumer(s)) for s in subs]
+    await asyncio.sleep(0)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    idle_bytes = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"{connections} idle connections: {idle_bytes / 1024 / 1024:.1f} MiB "
+          f"({idle_bytes / connections:.0f} B/connection)")
+
+    publish_times = []
+    for n in range(messages):
+        payload = json.dumps({"type": "message", "n": n, "sent_at": time.perf_counter()})
+        start = time.perf_counter()
+        broker.publish(f"chat:ch{n % channels}", payload)
+        publish_times.append(time.perf_counter() - start)
+        # Let consumers drain between messages, as a live server would between requests
+        await asyncio.sleep(0)
+    while len(latencies) < broker.delivered:
+        await asyncio.sleep(0)
+
+    latencies.sort()
+    per_channel = connections // channels
+    print(f"publish to {per_channel} subscribers: "
+          f"mean {statistics.mean(publish_times) * 1000:.2f} ms")
+    print(f"delivery latency over {len(latencies)} deliveries: "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, "
+          f"max {latencies[-1] * 1000:.2f} ms")
+    print(broker.stats())
+
+    for task in tasks:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.connections, args.messages, args.channels))
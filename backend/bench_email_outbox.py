@@ -0,0 +1,52 @@
+# Outbox throughput against a real Mongo (MONGO_URL) using the stub provider.
+#
+#   python bench_email_outbox.py --emails 5000 --workers 4 --latency-ms 200
+#
+# Enqueues N emails, starts the worker pool and reports enqueue cost per
+# request, end-to-end throughput and provider calls (one per batch).
+# Uses a throwaway email_outbox_bench collection so a live outbox is untouched.
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault('EMAIL_OUTBOX_COLLECTION', 'email_outbox_bench')
+os.environ.setdefault('EMAIL_BACKOFF_SECONDS', '0')
+
+import email_outbox
+
+
+async def main(emails: int, workers: int, latency_ms: float, fail_rate: float):
+    await email_outbox.outbox.drop()
+    await email_outbox.create_outbox_indexes()
+
+    start = time.perf_counter()
+    for i in range(emails):
+        await email_outbox.enqueue_email(f"user{i}@example.com", f"Bench {i}", "<p>bench</p>")
+    enqueue = time.perf_counter() - start
+    print(f"enqueue: {enqueue / emails * 1000:.2f} ms per request")
+
+    provider = email_outbox.StubEmailProvider(latency=latency_ms / 1000, fail_rate=fail_rate)
+    start = time.perf_counter()
+    tasks = email_outbox.start_workers(provider, workers)
+    while await email_outbox.outbox.count_documents({"status": {"$in": ["pending", "sending"]}}):
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+
+    sent = await email_outbox.outbox.count_documents({"status": "sent"})
+    dead = await email_outbox.outbox.count_documents({"status": "dead"})
+    print(f"sent {sent}/{emails} ({dead} dead) in {elapsed:.2f}s ({sent / elapsed:.0f} emails/s) "
+          f"with {provider.calls} provider calls from {workers} workers")
+    await email_outbox.outbox.drop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.emails, args.workers, args.latency_ms, args.fail_rate))
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timezone, timedelta
+from database import db
+from helpers import keyset_filter
+
+logger = logging.getLogger(__name__)
+
+# Messages stay one-document-per-message ("hot") until they are older than
+# COMPACT_AFTER_HOURS, then get packed BUCKET_SIZE at a time into
+# chat_message_buckets. Sender name/picture is stored once per bucket and the
+# message list is a zlib-compressed JSON blob.
+BUCKET_SIZE = int(os.environ.get('CHAT_BUCKET_SIZE', '200'))
+COMPACT_AFTER_HOURS = int(os.environ.get('CHAT_COMPACT_AFTER_HOURS', '24'))
+
+
+def _key(message: dict) -> tuple:
+    return message["created_at"], message["message_id"]
+
+
+def pack_bucket(channel_id: str, messages: list) -> dict:
+    senders = {}
+    rows = []
+    for m in messages:
+        senders[m["sender_id"]] = {"name": m.get("sender_name"), "picture": m.get("sender_picture", "")}
+        rows.append([m["message_id"], m["sender_id"], m["content"], m["created_at"]])
+    first, last = messages[0], messages[-1]
+    return {
+        "bucket_id": f"{channel_id}:{first['message_id']}",
+        "channel_id": channel_id,
+        "first_at": first["created_at"],
+        "first_id": first["message_id"],
+        "last_at": last["created_at"],
+        "last_id": last["message_id"],
+        "count": len(messages),
+        "senders": senders,
+        "payload": zlib.compress(json.dumps(rows, separators=(",", ":")).encode()),
+    }
+
+
+def unpack_bucket(bucket: dict) -> list:
+    senders = bucket["senders"]
+    messages = []
+    for message_id, sender_id, content, created_at in json.loads(zlib.decompress(bucket["payload"])):
+        sender = senders.get(sender_id, {})
+        messages.append({
+            "message_id": message_id,
+            "channel_id": bucket["channel_id"],
+            "sender_id": sender_id,
+            "sender_name": sender.get("name"),
+            "sender_picture": sender.get("picture", ""),
+            "content": content,
+            "created_at": created_at,
+        })
+    return messages
+
+
+async def _read_buckets(channel_id: str, limit: int, before: tuple = None, after: tuple = None) -> list:
+    query = {"channel_id": channel_id}
+    if after:
+        query.update(keyset_filter("last_at", "last_id", after, "$gt"))
+        order = 1
+    else:
+        if before:
+            query.update(keyset_filter("first_at", "first_id", before, "$lt"))
+        order = -1
+
+    found = []
+    cursor = db.chat_message_buckets.find(query, {"_id": 0}).sort([("last_at", order), ("last_id", order)])
+    async for bucket in cursor:
+        for m in unpack_bucket(bucket):
+            if (before and _key(m) >= before) or (after and _key(m) <= after):
+                continue
+            found.append(m)
+        if len(found) >= limit:
+            break
+    return found
+
+
+async def read_messages(channel_id: str, limit: int, before: tuple = None, after: tuple = None) -> list:
+    """Return up to `limit` messages in chronological order from hot and bucketed storage.
+
+    Without `after` this is the newest page (older than `before` if given);
+    with `after` it is the page immediately following that key.
+    """
+    query = {"channel_id": channel_id}
+    if after:
+        query.update(keyset_filter("created_at", "message_id", after, "$gt"))
+        order = 1
+    else:
+        if before:
+            query.update(keyset_filter("created_at", "message_id", before, "$lt"))
+        order = -1
+    hot = await db.chat_messages.find(query, {"_id": 0}).sort(
+        [("created_at", order), ("message_id", order)]
+    ).limit(limit).to_list(limit)
+
+    # Buckets only ever hold messages older than the hot ones, so a newest-first
+    # read touches them only once hot storage runs out; an after-read always
+    # starts from the buckets.
+    if after or len(hot) < limit:
+        cold = await _read_buckets(channel_id, limit, before, after)
+        seen = {m["message_id"] for m in hot}
+        hot.extend(m for m in cold if m["message_id"] not in seen)
+
+    hot.sort(key=_key, reverse=(order == -1))
+    page = hot[:limit]
+    if order == -1:
+        page.reverse()
+    return page
+
+
+async def compact_channel(channel_id: str, cutoff: str) -> int:
+    compacted = 0
+    while True:
+        messages = await db.chat_messages.find(
+            {"channel_id": channel_id, "created_at": {"$lt": cutoff}}, {"_id": 0}
+        ).sort([("created_at", 1), ("message_id", 1)]).limit(BUCKET_SIZE).to_list(BUCKET_SIZE)
+        # Only full buckets; a quiet channel's stragglers wait for the next run
+        if len(messages) < BUCKET_SIZE:
+            return compacted
+
+        bucket = pack_bucket(channel_id, messages)
+        # bucket_id is deterministic, so a run that died between the upsert and the
+        # delete just re-upserts the same bucket and finishes the delete
+        await db.chat_message_buckets.replace_one({"bucket_id": bucket["bucket_id"]}, bucket, upsert=True)
+        await db.chat_messages.delete_many(
+            {"message_id": {"$in": [m["message_id"] for m in messages]}}
+        )
+        compacted += len(messages)
+
+
+async def compact_cold_messages() -> int:
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=COMPACT_AFTER_HOURS)).isoformat()
+    channels = await db.chat_messages.aggregate([
+        {"$match": {"created_at": {"$lt": cutoff}}},
+        {"$group": {"_id": "$channel_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gte": BUCKET_SIZE}}},
+    ]).to_list(None)
+
+    total = 0
+    for ch in channels:
+        total += await compact_channel(ch["_id"], cutoff)
+    if total:
+        logger.info(f"Compacted {total} chat messages from {len(channels)} channels into buckets")
+    return total
+
+
+async def delete_channel_messages(channel_id: str):
+    await db.chat_messages.delete_many({"channel_id": channel_id})
+    await db.chat_message_buckets.delete_many({"channel_id": channel_id})
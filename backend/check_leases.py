@@ -0,0 +1,89 @@
+# Leader election check against a real Mongo (MONGO_URL), several processes.
+#
+#   python check_leases.py --processes 4 --seconds 40 --ttl 3
+#
+# Starts N processes, each with its own scheduler and one exclusive job that
+# records every run in a throwaway collection. Halfway through, the process
+# holding the lease is killed (SIGKILL, so it can't release). Reports the
+# runs per process and fails if two runs ever overlapped or if nobody took
+# over after the kill.
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('LEASE_COLLECTION', 'job_leases_check')
+
+
+async def worker(interval: float, ttl: int):
+    from leases import LeaseManager, PROCESS_ID
+    from scheduler import Scheduler
+    from database import db
+    runs = db.job_leases_check_log
+
+    async def probe():
+        started = time.time()
+        await asyncio.sleep(interval / 2)
+        await runs.insert_one({"process": PROCESS_ID, "pid": os.getpid(), "started": started, "ended": time.time()})
+
+    scheduler = Scheduler(LeaseManager(ttl=ttl))
+    scheduler.add_job(probe, interval, name="probe", jitter=0)
+    scheduler.start()
+    await asyncio.Event().wait()
+
+
+async def report(started: float, killed_pid: int, killed_at: float) -> bool:
+    from database import db
+    runs = await db.job_leases_check_log.find({}, {"_id": 0}).sort("started", 1).to_list(None)
+    per_pid = {}
+    for run in runs:
+        per_pid[run["pid"]] = per_pid.get(run["pid"], 0) + 1
+    overlaps = sum(1 for a, b in zip(runs, runs[1:]) if b["started"] < a["ended"])
+    after_kill = [r for r in runs if r["started"] > killed_at]
+    print(f"runs: {len(runs)} in {time.time() - started:.0f}s, per process: {per_pid}")
+    print(f"killed leader pid {killed_pid}; runs after kill: {len(after_kill)} "
+          f"(first after {after_kill[0]['started'] - killed_at:.1f}s)" if after_kill else "no runs after kill")
+    print(f"overlapping runs: {overlaps}")
+    return overlaps == 0 and bool(after_kill) and all(r["pid"] != killed_pid for r in after_kill)
+
+
+async def main(processes: int, seconds: int, interval: float, ttl: int):
+    from database import db
+    await db.job_leases_check.drop()
+    await db.job_leases_check_log.drop()
+
+    procs = [
+        subprocess.Popen([sys.executable, __file__, "--worker", "--interval", str(interval), "--ttl", str(ttl)])
+        for _ in range(processes)
+    ]
+    started = time.time()
+    try:
+        await asyncio.sleep(seconds / 2)
+        lease = await db.job_leases_check.find_one({"_id": "probe"})
+        leader_pid = int(lease["holder"].split(":")[1])
+        os.kill(leader_pid, signal.SIGKILL)
+        killed_at = time.time()
+        await asyncio.sleep(seconds / 2)
+    finally:
+        for proc in procs:
+            proc.kill()
+    ok = await report(started, leader_pid, killed_at)
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--seconds", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--ttl", type=int, default=3)
+    parser.add_argument("--worker", action="store_true")
+    args = parser.parse_args()
+    if args.worker:
+        asyncio.run(worker(args.interval, args.ttl))
+    else:
+        sys.exit(0 if asyncio.run(main(args.processes, args.seconds, args.interval, args.ttl)) else 1)
@@ -0,0 +1,57 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+
+# Bookkeeping shared by the in-memory copies of Mongo collections (the AI
+# context snapshot, the user search index). Write paths call invalidate() with
+# the ids they touched; the next refresh() hands just those to _patch(), one
+# set per kind, so it can re-fetch them with a single $in query each. A full
+# _load() runs on first use, after invalidate_all(), and every refresh_seconds
+# so writes made by other processes are picked up.
+
+
+class CollectionMirror(ABC):
+    def __init__(self, kinds, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._dirty = {kind: set() for kind in kinds}
+        self._reload = True
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self.stats = {"hits": 0, "patches": 0, "reloads": 0}
+
+    def invalidate(self, kind: str, *entity_ids: str):
+        self._dirty[kind].update(entity_ids)
+
+    def invalidate_all(self):
+        # For bulk writes where the touched ids are unknown, e.g. deleting a project's tasks
+        self._reload = True
+
+    @abstractmethod
+    async def _load(self):
+        """Replace the whole copy with what the collections hold now."""
+
+    @abstractmethod
+    async def _patch(self, dirty: dict):
+        """Re-fetch the given ids ({kind: set of ids}), dropping any that no longer exist."""
+
+    def _changed(self):
+        """Called under the lock after every load or patch."""
+
+    async def refresh(self):
+        async with self._lock:
+            if self._reload or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                # Taken before reading: invalidations that land meanwhile stay queued for the next refresh
+                self._reload = False
+                self._dirty = {kind: set() for kind in self._dirty}
+                await self._load()
+                self._loaded_at = time.monotonic()
+                self.stats["reloads"] += 1
+            elif any(self._dirty.values()):
+                dirty = {kind: ids for kind, ids in self._dirty.items() if ids}
+                self._dirty = {kind: set() for kind in self._dirty}
+                await self._patch(dirty)
+                self.stats["patches"] += 1
+            else:
+                self.stats["hits"] += 1
+                return
+            self._changed()
@@ -15,5 +15,6 @@ mongo_url = os.environ.get('MONGO_URL')
 client = AsyncIOMotorClient(mongo_url)
 
 # 3. Set the Database Name 
-# We use the actual name 'Enterprise-Management-System' directly as the database name
-db = client['Enterprise-Management-System']
\ No newline at end of file
+# We use the actual name 'Enterprise-Management-System' as the database name;
+# DB_NAME overrides it for benchmarks and other throwaway runs
+db = client[os.environ.get('DB_NAME', 'Enterprise-Management-System')]
\ No newline at end of file
@@ -0,0 +1,67 @@
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from database import db
+from helpers import build_notification, upsert_notifications
+
+logger = logging.getLogger(__name__)
+
+# Warns assignees about open tasks due within the next DEADLINE_WARNING_HOURS.
+# Tasks are streamed from a cursor on the (status, due_date) index and alerts
+# are written DEADLINE_SCAN_BATCH at a time as unordered upserts keyed on
+# dedupe_key, so every batch costs one getMore plus two bulk writes no matter
+# how many tasks there are, and re-running a scan never duplicates an alert.
+DEADLINE_WARNING_HOURS = int(os.environ.get('DEADLINE_WARNING_HOURS', '48'))
+SCAN_BATCH = int(os.environ.get('DEADLINE_SCAN_BATCH', '1000'))
+
+
+def dedupe_key(task: dict) -> str:
+    # One alert per task, assignee and due date: moving the deadline or
+    # reassigning the task warns again, re-scanning does not
+    return f"deadline_warning:{task['task_id']}:{task['assigned_to']}:{task['due_date']}"
+
+
+def deadline_alert(task: dict) -> dict:
+    notif = build_notification(
+        user_id=task["assigned_to"],
+        notif_type="deadline_warning",
+        title="Upcoming Deadline!",
+        message=f"Reminder: The task '{task['title']}' is due soon.",
+        link="/tasks",
+    )
+    notif["dedupe_key"] = dedupe_key(task)
+    return notif
+
+
+async def create_deadline_indexes():
+    await db.tasks.create_index([("status", 1), ("due_date", 1)])
+    await db.notifications.create_index(
+        "dedupe_key", unique=True, partialFilterExpression={"dedupe_key": {"$exists": True}},
+    )
+
+
+async def scan_deadlines() -> dict:
+    now = datetime.now(timezone.utc)
+    cursor = db.tasks.find(
+        {
+            "status": {"$ne": "done"},
+            "due_date": {"$gte": now.isoformat(), "$lte": (now + timedelta(hours=DEADLINE_WARNING_HOURS)).isoformat()},
+            "assigned_to": {"$nin": [None, ""]},
+        },
+        {"_id": 0, "task_id": 1, "title": 1, "assigned_to": 1, "due_date": 1},
+        batch_size=SCAN_BATCH,
+    )
+
+    scanned = sent = 0
+    batch = []
+    async for task in cursor:
+        scanned += 1
+        batch.append(deadline_alert(task))
+        if len(batch) >= SCAN_BATCH:
+            sent += len(await upsert_notifications(batch))
+            batch = []
+    if batch:
+        sent += len(await upsert_notifications(batch))
+
+    logger.info(f"Deadline scan: {scanned} due-soon tasks, {sent} new alerts")
+    return {"scanned": scanned, "sent": sent}
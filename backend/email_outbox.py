@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import random
+import resend
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne
+from resend.exceptions import ResendError, ValidationError
+from database import db
+from models import gen_id
+
+logger = logging.getLogger(__name__)
+
+# Requests only insert into email_outbox; a pool of workers claims due jobs in
+# batches under a lease, sends each batch with one provider call and either
+# marks the jobs sent or schedules a retry with exponential backoff. Jobs that
+# run out of attempts are kept with status "dead" for inspection.
+EMAIL_PROVIDER = os.environ.get('EMAIL_PROVIDER', 'resend')
+OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS', '2'))
+BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '50'))  # Resend accepts up to 100 per batch
+LEASE_SECONDS = int(os.environ.get('EMAIL_LEASE_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '6'))
+BACKOFF_SECONDS = int(os.environ.get('EMAIL_BACKOFF_SECONDS', '30'))
+POLL_SECONDS = float(os.environ.get('EMAIL_POLL_SECONDS', '5'))
+SENT_RETENTION_DAYS = 7
+
+outbox = db[os.environ.get('EMAIL_OUTBOX_COLLECTION', 'email_outbox')]
+_wakeup = asyncio.Event()
+
+
+class ResendProvider:
+    def __init__(self, sender: str):
+        self.sender = sender
+
+    async def send_batch(self, emails: list):
+        params = [
+            {"from": self.sender, "to": [e["to"]], "subject": e["subject"], "html": e["html"]}
+            for e in emails
+        ]
+        return await asyncio.to_thread(resend.Batch.send, params)
+
+
+class StubEmailProvider:
+    """Counts emails instead of sending them. Selected with EMAIL_PROVIDER=stub
+    for local development and used by bench_email_outbox.py. Addresses in
+    reject are refused the way Resend refuses an invalid recipient."""
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, reject=()):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.reject = set(reject)
+        self.sent = 0
+        self.calls = 0
+
+    async def send_batch(self, emails: list):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise RuntimeError("stub provider failure")
+        if any(e["to"] in self.reject for e in emails):
+            raise ValidationError("Invalid `to` field.", "validation_error", 422)
+        self.sent += len(emails)
+        return {"data": [{"id": gen_id("stub_")} for _ in emails]}
+
+
+def get_provider():
+    from helpers import SENDER_EMAIL
+    if EMAIL_PROVIDER == "stub":
+        latency = float(os.environ.get('EMAIL_STUB_LATENCY_MS', '0')) / 1000
+        return StubEmailProvider(latency=latency)
+    if not resend.api_key:
+        return None
+    return ResendProvider(SENDER_EMAIL)
+
+
+def build_job(to_email: str, subject: str, html_content: str) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "job_id": gen_id("mail_"),
+        "to": to_email,
+        "subject": subject,
+        "html": html_content,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "lease_until": None,
+        "claim_id": None,
+        "last_error": None,
+        "created_at": now,
+    }
+
+
+async def enqueue_email(to_email: str, subject: str, html_content: str) -> str:
+    job = build_job(to_email, subject, html_content)
+    await outbox.insert_one(job)
+    _wakeup.set()
+    return job["job_id"]
+
+
+async def enqueue_emails(emails: list) -> list:
+    # emails: [{"to", "subject", "html"}]; one insert_many for the lot
+    jobs = [build_job(e["to"], e["subject"], e["html"]) for e in emails]
+    if jobs:
+        await outbox.insert_many(jobs, ordered=False)
+        _wakeup.set()
+    return [j["job_id"] for j in jobs]
+
+
+async def claim_batch(limit: int = BATCH_SIZE) -> list:
+    now = datetime.now(timezone.utc)
+    due = {"$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now}},
+        # A worker that died mid-send leaves its lease to run out
+        {"status": "sending", "lease_until": {"$lt": now}},
+    ]}
+    candidates = await outbox.find(due, {"_id": 0, "job_id": 1}).limit(limit).to_list(limit)
+    if not candidates:
+        return []
+
+    # Re-check the due condition in the update so two workers racing on the same
+    # candidates each only get the jobs they actually flipped
+    claim_id = gen_id("claim_")
+    await outbox.update_many(
+        {"job_id": {"$in": [c["job_id"] for c in candidates]}, **due},
+        {"$set": {"status": "sending", "claim_id": claim_id,
+                  "lease_until": now + timedelta(seconds=LEASE_SECONDS)},
+         "$inc": {"attempts": 1}},
+    )
+    return await outbox.find({"claim_id": claim_id, "status": "sending"}, {"_id": 0}).to_list(limit)
+
+
+def backoff(attempts: int) -> timedelta:
+    delay = BACKOFF_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def is_rejection(e: Exception) -> bool:
+    # The provider refused the emails themselves (bad address, invalid field),
+    # as opposed to being unreachable, rate limiting us or rejecting our key
+    return isinstance(e, ResendError) and str(e.code) in ("400", "422")
+
+
+async def fail_jobs(jobs: list, e: Exception):
+    now = datetime.now(timezone.utc)
+    ops = []
+    for job in jobs:
+        # A rejected email is rejected again on every retry
+        if job["attempts"] >= MAX_ATTEMPTS or is_rejection(e):
+            update = {"status": "dead", "last_error": str(e), "dead_at": now}
+        else:
+            update = {"status": "pending", "last_error": str(e),
+                      "next_attempt_at": now + backoff(job["attempts"])}
+        ops.append(UpdateOne({"job_id": job["job_id"], "claim_id": job["claim_id"]}, {"$set": update}))
+    await outbox.bulk_write(ops, ordered=False)
+
+
+async def deliver_batch(jobs: list, provider) -> int:
+    try:
+        await provider.send_batch(jobs)
+    except Exception as e:
+        if len(jobs) > 1 and is_rejection(e):
+            # One bad email fails the whole batch; resend the jobs one at a time
+            # so only the ones actually rejected are dead-lettered
+            logger.warning(f"Batch of {len(jobs)} emails rejected, sending them individually: {e}")
+            sent = 0
+            for job in jobs:
+                sent += await deliver_batch([job], provider)
+            return sent
+        logger.error(f"Failed to send batch of {len(jobs)} emails: {e}")
+        await fail_jobs(jobs, e)
+        return 0
+
+    now = datetime.now(timezone.utc)
+    await outbox.update_many(
+        {"job_id": {"$in": [j["job_id"] for j in jobs]}, "claim_id": jobs[0]["claim_id"]},
+        {"$set": {"status": "sent", "sent_at": now, "lease_until": None}},
+    )
+    return len(jobs)
+
+
+async def run_worker(provider):
+    while True:
+        try:
+            jobs = await claim_batch()
+            if jobs:
+                await deliver_batch(jobs, provider)
+                continue
+        except Exception:
+            # Claimed jobs are retried by whoever picks them up once the lease runs out
+            logger.exception("Email outbox worker failed")
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_workers(provider=None, workers: int = OUTBOX_WORKERS) -> list:
+    provider = provider or get_provider()
+    if provider is None:
+        logger.warning("No Resend API key configured, emails stay queued in the outbox until one is")
+        return []
+    return [asyncio.create_task(run_worker(provider)) for _ in range(workers)]
+
+
+async def create_outbox_indexes():
+    await outbox.create_index("job_id", unique=True)
+    await outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+    await outbox.create_index([("status", 1), ("lease_until", 1)])
+    await outbox.create_index("claim_id")
+    await outbox.create_index("sent_at", expireAfterSeconds=SENT_RETENTION_DAYS * 86400)
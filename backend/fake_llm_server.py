@@ -0,0 +1,114 @@
+# Local stand-in for the Groq chat completions API so the AI endpoints can be
+# load-tested offline:
+#
+#   FAKE_LLM_LATENCY_MS=800 FAKE_LLM_TOKEN_MS=20 uvicorn fake_llm_server:app --port 9000
+#   GROQ_BASE_URL=http://localhost:9000 GROQ_API_KEY=fake uvicorn server:app
+#
+# LATENCY_MS is the time to the first token and TOKEN_MS the time per further
+# token (one word counts as a token); "stream": true requests get OpenAI-style
+# SSE chunks. With FAKE_LLM_REPLAY pointing at a JSON list of recorded
+# responses (see bench_agent_replay.json), the first entry whose "match" regex
+# is found in the user prompt is replayed, tool calls included. Anything
+# unmatched gets canned text echoing the prompt.
+import asyncio
+import json
+import os
+import re
+import time
+from fastapi import FastAPI, Body
+from fastapi.responses import StreamingResponse
+from models import gen_id
+
+LATENCY_MS = float(os.environ.get('FAKE_LLM_LATENCY_MS', '500'))
+TOKEN_MS = float(os.environ.get('FAKE_LLM_TOKEN_MS', '0'))
+REPLAY_PATH = os.environ.get('FAKE_LLM_REPLAY')
+
+app = FastAPI(title="Fake LLM")
+
+
+def load_replay(path: str) -> list:
+    if not path:
+        return []
+    with open(path) as f:
+        entries = json.load(f)
+    for entry in entries:
+        entry["pattern"] = re.compile(entry.get("match") or re.escape(entry["prompt"]), re.IGNORECASE)
+    return entries
+
+
+REPLAY = load_replay(REPLAY_PATH)
+
+
+def respond(prompt: str) -> tuple:
+    """Return (content, tool_calls) for the prompt; tool_calls in API shape."""
+    for entry in REPLAY:
+        if entry["pattern"].search(prompt):
+            tool_calls = [{
+                "id": gen_id("call_"),
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])},
+            } for call in entry.get("tool_calls", [])]
+            return entry.get("content") or "", tool_calls
+    return f"(fake) You asked: {prompt[:200]}", []
+
+
+def output_tokens(content: str, tool_calls: list) -> int:
+    # Words of content, plus roughly one token per 4 characters of tool arguments
+    return len(content.split()) + sum(len(c["function"]["arguments"]) // 4 for c in tool_calls)
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(payload: dict = Body(...)):
+    prompt = payload["messages"][-1]["content"]
+    content, tool_calls = respond(prompt)
+    if payload.get("stream"):
+        return StreamingResponse(stream_chunks(payload, content, tool_calls), media_type="text/event-stream")
+
+    completion_tokens = output_tokens(content, tool_calls)
+    await asyncio.sleep((LATENCY_MS + TOKEN_MS * max(completion_tokens - 1, 0)) / 1000)
+    prompt_tokens = sum(len(m.get("content") or "") for m in payload["messages"]) // 4
+    message = {"role": "assistant", "content": content or None}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return {
+        "id": gen_id("chatcmpl_"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if tool_calls else "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+async def stream_chunks(payload: dict, content: str, tool_calls: list):
+    completion_id = gen_id("chatcmpl_")
+    created = int(time.time())
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + "\n\n"
+
+    await asyncio.sleep(LATENCY_MS / 1000)
+    yield chunk({"role": "assistant"})
+    for i, word in enumerate(content.split(" ") if content else []):
+        if i:
+            await asyncio.sleep(TOKEN_MS / 1000)
+        yield chunk({"content": word if not i else " " + word})
+    for i, call in enumerate(tool_calls):
+        await asyncio.sleep(TOKEN_MS * output_tokens("", [call]) / 1000)
+        yield chunk({"tool_calls": [{"index": i, **call}]})
+    yield chunk({}, "tool_calls" if tool_calls else "stop")
+    yield "data: [DONE]\n\n"
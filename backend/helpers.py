@@ -1,19 +1,67 @@
-import asyncio
+import base64
+import json
 import os
 import logging
+import time
 import resend
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+from fastapi import HTTPException
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 from database import db
 from models import gen_id
+from realtime import broker, notification_topic
+from email_outbox import enqueue_email
 
 logger = logging.getLogger(__name__)
 
 resend.api_key = os.environ.get('RESEND_API_KEY', '')
 SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'onboarding@resend.dev')
+# Fan-outs to more recipients than this are handed to a background task by the routes
+NOTIFY_INLINE_LIMIT = int(os.environ.get('NOTIFY_INLINE_LIMIT', '50'))
+# How long this process trusts its cached copy of a user's unread counter
+UNREAD_CACHE_SECONDS = int(os.environ.get('UNREAD_CACHE_SECONDS', '30'))
+# Notifications are removed by a TTL index on expires_at; reading one shortens its life
+UNREAD_RETENTION_DAYS = int(os.environ.get('NOTIFY_UNREAD_RETENTION_DAYS', '180'))
+READ_RETENTION_DAYS = int(os.environ.get('NOTIFY_READ_RETENTION_DAYS', '30'))
 
+_unread_cache = {}
 
-async def create_notification(user_id: str, notif_type: str, title: str, message: str, link: str = ""):
-    notif = {
+
+def encode_cursor(sort_value: str, item_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{sort_value}|{item_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        # Ids never contain "|" but sort values (e.g. names) might
+        sort_value, item_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_value, item_id
+
+
+def sse_frame(event_id, event: str, data: str) -> str:
+    frame = f"event: {event}\ndata: {data}\n\n"
+    return f"id: {event_id}\n{frame}" if event_id else frame
+
+
+def keyset_filter(sort_field: str, id_field: str, key: tuple, op: str) -> dict:
+    # Compare on (sort_field, id_field) so rows sharing a sort value are never skipped
+    sort_value, item_id = key
+    return {"$or": [
+        {sort_field: {op: sort_value}},
+        {sort_field: sort_value, id_field: {op: item_id}},
+    ]}
+
+
+def notification_expiry(read: bool) -> datetime:
+    days = READ_RETENTION_DAYS if read else UNREAD_RETENTION_DAYS
+    return datetime.now(timezone.utc) + timedelta(days=days)
+
+
+def build_notification(user_id: str, notif_type: str, title: str, message: str, link: str = "") -> dict:
+    return {
         "notification_id": gen_id("notif_"),
         "user_id": user_id,
         "type": notif_type,
@@ -21,12 +69,132 @@ async def create_notification(user_id: str, notif_type: str, title: str, message
         "message": message,
         "read": False,
         "link": link,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "expires_at": notification_expiry(read=False),
     }
+
+
+def publish_notification(notif: dict):
+    # Events are (id, event, data) tuples; the SSE stream frames them per connection
+    data = json.dumps({k: v for k, v in notif.items() if k != "_id"}, default=str)
+    broker.publish(notification_topic(notif["user_id"]), (notif["notification_id"], "notification", data))
+
+
+def publish_unread(user_id: str, delta: int, count: int = None):
+    payload = {"delta": delta} if count is None else {"delta": delta, "count": count}
+    broker.publish(notification_topic(user_id), (None, "unread", json.dumps(payload)))
+
+
+async def adjust_unread_count(user_id: str, delta: int):
+    if not delta:
+        return
+    counter = await db.notification_counters.find_one_and_update(
+        {"user_id": user_id},
+        {"$inc": {"unread": delta}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    count = max(0, counter["unread"])
+    _unread_cache[user_id] = (count, time.monotonic() + UNREAD_CACHE_SECONDS)
+    publish_unread(user_id, delta, count)
+
+
+async def get_unread_count(user_id: str) -> int:
+    cached = _unread_cache.get(user_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    counter = await db.notification_counters.find_one({"user_id": user_id}, {"_id": 0, "unread": 1})
+    if counter is None:
+        # First read for this user: seed the counter from the notifications themselves
+        count = await db.notifications.count_documents({"user_id": user_id, "read": False})
+        await db.notification_counters.update_one(
+            {"user_id": user_id}, {"$setOnInsert": {"unread": count}}, upsert=True
+        )
+    else:
+        count = max(0, counter["unread"])
+    _unread_cache[user_id] = (count, time.monotonic() + UNREAD_CACHE_SECONDS)
+    return count
+
+
+async def reconcile_unread_counts():
+    """Rewrite every counter from the notifications collection.
+
+    Counters only drift through paths that bypass the helpers (TTL expiry,
+    manual edits, a crash between the insert and the $inc), so this runs rarely.
+    """
+    actual = await db.notifications.aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}},
+    ]).to_list(None)
+    counts = {row["_id"]: row["unread"] for row in actual}
+    async for counter in db.notification_counters.find({}, {"_id": 0, "user_id": 1}):
+        counts.setdefault(counter["user_id"], 0)
+    if counts:
+        await db.notification_counters.bulk_write(
+            [UpdateOne({"user_id": uid}, {"$set": {"unread": n}}, upsert=True) for uid, n in counts.items()],
+            ordered=False,
+        )
+    _unread_cache.clear()
+    return len(counts)
+
+
+async def backfill_notification_expiry():
+    # Notifications written before retention existed start their retention clock now
+    for read in (False, True):
+        await db.notifications.update_many(
+            {"expires_at": {"$exists": False}, "read": read},
+            {"$set": {"expires_at": notification_expiry(read)}},
+        )
+
+
+async def create_notification(user_id: str, notif_type: str, title: str, message: str, link: str = ""):
+    notif = build_notification(user_id, notif_type, title, message, link)
     await db.notifications.insert_one(notif)
+    publish_notification(notif)
+    await adjust_unread_count(user_id, 1)
     return notif
 
 
+async def _count_and_publish(notifs: list):
+    await db.notification_counters.bulk_write(
+        [UpdateOne({"user_id": n["user_id"]}, {"$inc": {"unread": 1}}, upsert=True) for n in notifs],
+        ordered=False,
+    )
+    for notif in notifs:
+        _unread_cache.pop(notif["user_id"], None)
+        publish_notification(notif)
+        publish_unread(notif["user_id"], 1)
+
+
+async def insert_notifications(notifs: list):
+    # One unordered insert_many for the whole batch, one bulk_write for the counters
+    if not notifs:
+        return notifs
+    await db.notifications.insert_many(notifs, ordered=False)
+    await _count_and_publish(notifs)
+    return notifs
+
+
+async def upsert_notifications(notifs: list) -> list:
+    """Insert notifications that carry a dedupe_key unless one with the same
+    key already exists (unique index). Returns the ones actually inserted."""
+    if not notifs:
+        return notifs
+    ops = [UpdateOne({"dedupe_key": n["dedupe_key"]}, {"$setOnInsert": n}, upsert=True) for n in notifs]
+    try:
+        result = await db.notifications.bulk_write(ops, ordered=False)
+        upserted = result.upserted_ids
+    except BulkWriteError as e:
+        # Two writers racing on one key: the loser's upsert hits the unique index
+        if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+            raise
+        upserted = {u["index"]: u["_id"] for u in e.details["upserted"]}
+    inserted = [notifs[i] for i in sorted(upserted)]
+    if inserted:
+        await _count_and_publish(inserted)
+    return inserted
+
+
 async def log_activity(user_id: str, user_name: str, action: str, entity_type: str, entity_id: str, entity_name: str, project_id: str = ""):
     activity = {
         "activity_id": gen_id("act_"),
@@ -44,36 +212,12 @@ async def log_activity(user_id: str, user_name: str, action: str, entity_type: s
 
 
 async def send_email_notification(to_email: str, subject: str, html_content: str):
-    if not resend.api_key:
-        logger.warning("No Resend API key configured, skipping email")
-        return None
-    try:
-        params = {
-            "from": SENDER_EMAIL,
-            "to": [to_email],
-            "subject": subject,
-            "html": html_content,
-        }
-        result = await asyncio.to_thread(resend.Emails.send, params)
-        logger.info(f"Email sent to {to_email}: {result}")
-        return result
-    except Exception as e:
-        logger.error(f"Failed to send email to {to_email}: {e}")
-        return None
+    # Queued in the outbox; email_outbox workers do the actual sending and retries
+    return await enqueue_email(to_email, subject, html_content)
 
 
-async def notify_task_assigned(task: dict, assignee: dict, assigner_name: str):
-    await create_notification(
-        user_id=assignee["user_id"],
-        notif_type="task_assigned",
-        title="New Task Assigned",
-        message=f"{assigner_name} assigned you the task: {task['title']}",
-        link=f"/tasks"
-    )
-    await send_email_notification(
-        to_email=assignee["email"],
-        subject=f"New Task: {task['title']}",
-        html_content=f"""
+def task_assigned_email(task: dict, assigner_name: str) -> str:
+    return f"""
         <div style="font-family:Arial,sans-serif;padding:20px;background:#09090b;color:#fafafa;">
             <h2 style="color:#6366f1;">New Task Assigned</h2>
             <p>{assigner_name} assigned you a new task:</p>
@@ -83,15 +227,30 @@ async def notify_task_assigned(task: dict, assignee: dict, assigner_name: str):
                 <p style="color:#a1a1aa;margin:8px 0 0;">Priority: {task.get('priority', 'medium').upper()}</p>
             </div>
         </div>"""
+
+
+async def notify_task_assigned(task: dict, assignee: dict, assigner_name: str):
+    from notification_digest import queue_notifications
+    await queue_notifications(
+        user_ids=[assignee["user_id"]],
+        notif_type="task_assigned",
+        title="New Task Assigned",
+        message=f"{assigner_name} assigned you the task: {task['title']}",
+        link=f"/tasks",
+        email={
+            "to": assignee["email"],
+            "subject": f"New Task: {task['title']}",
+            "html": task_assigned_email(task, assigner_name),
+        },
     )
 
 
 async def notify_project_update(project: dict, user_ids: list, updater_name: str, change: str):
-    for uid in user_ids:
-        await create_notification(
-            user_id=uid,
-            notif_type="project_update",
-            title="Project Updated",
-            message=f"{updater_name} {change} in project: {project['name']}",
-            link=f"/projects/{project['project_id']}"
-        )
+    from notification_digest import queue_notifications
+    await queue_notifications(
+        user_ids=user_ids,
+        notif_type="project_update",
+        title="Project Updated",
+        message=f"{updater_name} {change} in project: {project['name']}",
+        link=f"/projects/{project['project_id']}"
+    )
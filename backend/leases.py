@@ -0,0 +1,108 @@
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Mongo-backed leases so each exclusive scheduled job runs in exactly one
+# process across all workers and replicas. A lease is one document per job:
+#
+#   {_id: job name, holder: process id, token: fencing token, expires_at, requested: [run ids]}
+#
+# The holder renews it every LEASE_TTL_SECONDS / 3; if the holder dies the
+# lease expires and the next process to try takes it over. The token is bumped
+# on every change of holder and renewals are conditional on it, so a holder
+# that stalled past expiry finds out on its next renewal instead of running on
+# alongside the new one. Lease documents are never deleted, which keeps the
+# token monotonic. Manual triggers that land on a non-holder are queued in
+# `requested` for the holder to pick up on its next renewal.
+LEASE_COLLECTION = os.environ.get('LEASE_COLLECTION', 'job_leases')
+LEASE_TTL_SECONDS = int(os.environ.get('LEASE_TTL_SECONDS', '30'))
+JOB_RUN_RETENTION_DAYS = 7
+
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+leases = db[LEASE_COLLECTION]
+job_runs = db[f"{LEASE_COLLECTION}_runs"]
+
+
+class LeaseManager:
+    def __init__(self, owner: str = PROCESS_ID, ttl: int = LEASE_TTL_SECONDS):
+        self.owner = owner
+        self.ttl = ttl
+        self.tokens = {}  # job name -> fencing token for the leases we hold
+
+    @property
+    def renew_seconds(self) -> float:
+        return self.ttl / 3
+
+    def holds(self, name: str) -> bool:
+        return name in self.tokens
+
+    async def keep(self, name: str) -> list:
+        """Renew the lease if we hold it, otherwise try to take it. Returns the
+        run ids of manual triggers queued for us since the last call."""
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl)
+        token = self.tokens.get(name)
+        if token is not None:
+            doc = await leases.find_one_and_update(
+                {"_id": name, "holder": self.owner, "token": token},
+                {"$set": {"expires_at": expires_at, "requested": []}},
+                return_document=ReturnDocument.BEFORE,
+            )
+            if doc:
+                return doc.get("requested", [])
+            del self.tokens[name]
+            logger.warning(f"Lost lease for {name} (token {token})")
+            return []
+
+        try:
+            doc = await leases.find_one_and_update(
+                {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"expires_at": {"$exists": False}}]},
+                {"$set": {"holder": self.owner, "expires_at": expires_at}, "$inc": {"token": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Held by someone else and not expired: the upsert collided with their document
+            return []
+        self.tokens[name] = doc["token"]
+        logger.info(f"Acquired lease for {name} (token {doc['token']})")
+        return []
+
+    async def request_run(self, name: str, run_id: str) -> bool:
+        result = await leases.update_one({"_id": name}, {"$push": {"requested": run_id}})
+        return result.modified_count == 1
+
+    async def release(self, name: str):
+        token = self.tokens.pop(name, None)
+        if token is not None:
+            await leases.update_one(
+                {"_id": name, "holder": self.owner, "token": token},
+                {"$set": {"expires_at": datetime.now(timezone.utc)}},
+            )
+
+    async def release_all(self):
+        for name in list(self.tokens):
+            await self.release(name)
+
+
+async def save_run(run: dict):
+    # Manual runs are kept in Mongo so any process can answer a status lookup
+    doc = {**run, "expires_at": datetime.now(timezone.utc) + timedelta(days=JOB_RUN_RETENTION_DAYS)}
+    await job_runs.replace_one({"run_id": run["run_id"]}, doc, upsert=True)
+
+
+async def find_run(run_id: str):
+    return await job_runs.find_one({"run_id": run_id}, {"_id": 0, "expires_at": 0})
+
+
+async def create_lease_indexes():
+    await job_runs.create_index("run_id", unique=True)
+    await job_runs.create_index("expires_at", expireAfterSeconds=0)
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from groq import AsyncGroq
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = os.environ.get('LLM_MODEL', 'llama-3.3-70b-versatile')
+# Calls beyond this many wait in line instead of piling onto the provider's rate limit
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '8'))
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '30'))
+
+
+class LLMTimeout(Exception):
+    pass
+
+
+class LLMClient:
+    """Async wrapper around the Groq SDK with a concurrency cap, a per-call
+    timeout and queue/latency counters. Point GROQ_BASE_URL at
+    fake_llm_server.py to run without the real API."""
+
+    def __init__(self, concurrency: int = LLM_CONCURRENCY, timeout: float = LLM_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._client = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.metrics = {
+            "calls": 0, "in_flight": 0, "waiting": 0,
+            "timeouts": 0, "errors": 0, "cancelled": 0,
+            "queue_seconds_total": 0.0, "queue_seconds_max": 0.0,
+            "call_seconds_total": 0.0, "call_seconds_max": 0.0,
+            "streams": 0, "first_token_seconds_total": 0.0, "first_token_seconds_max": 0.0,
+        }
+
+    @property
+    def client(self) -> AsyncGroq:
+        # Created on first use so the app can start without GROQ_API_KEY
+        if self._client is None:
+            self._client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=1)
+        return self._client
+
+    def _record(self, name: str, seconds: float):
+        self.metrics[f"{name}_seconds_total"] += seconds
+        self.metrics[f"{name}_seconds_max"] = max(self.metrics[f"{name}_seconds_max"], seconds)
+
+    @asynccontextmanager
+    async def _slot(self):
+        # Waits for a free slot, then counts the call, its latency and how it ended
+        m = self.metrics
+        enqueued = time.perf_counter()
+        m["waiting"] += 1
+        try:
+            await self._semaphore.acquire()
+        except asyncio.CancelledError:
+            m["cancelled"] += 1
+            raise
+        finally:
+            m["waiting"] -= 1
+
+        self._record("queue", time.perf_counter() - enqueued)
+        m["in_flight"] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.TimeoutError:
+            m["timeouts"] += 1
+            raise LLMTimeout(f"LLM call exceeded {self.timeout}s")
+        except asyncio.CancelledError:
+            m["cancelled"] += 1
+            raise
+        except Exception:
+            m["errors"] += 1
+            raise
+        finally:
+            self._semaphore.release()
+            m["in_flight"] -= 1
+            m["calls"] += 1
+            self._record("call", time.perf_counter() - started)
+
+    async def complete(self, **kwargs):
+        kwargs.setdefault("model", LLM_MODEL)
+        async with self._slot():
+            return await asyncio.wait_for(self.client.chat.completions.create(**kwargs), self.timeout)
+
+    async def stream(self, **kwargs):
+        """Yield completion chunks as they arrive. The timeout applies to the
+        wait for each chunk rather than to the whole completion."""
+        kwargs.setdefault("model", LLM_MODEL)
+        async with self._slot():
+            started = time.perf_counter()
+            self.metrics["streams"] += 1
+            chunks = await asyncio.wait_for(self.client.chat.completions.create(stream=True, **kwargs), self.timeout)
+            try:
+                first = True
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    if first:
+                        self._record("first_token", time.perf_counter() - started)
+                        first = False
+                    yield chunk
+            finally:
+                await chunks.close()
+
+    def snapshot(self) -> dict:
+        m = dict(self.metrics)
+        calls = m["calls"] or 1
+        m["concurrency"] = self.concurrency
+        m["queue_seconds_avg"] = round(m["queue_seconds_total"] / calls, 4)
+        m["call_seconds_avg"] = round(m["call_seconds_total"] / calls, 4)
+        m["first_token_seconds_avg"] = round(m["first_token_seconds_total"] / (m["streams"] or 1), 4)
+        return m
+
+
+llm = LLMClient()
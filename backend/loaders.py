@@ -0,0 +1,109 @@
+import asyncio
+import contextvars
+from database import db
+
+# DataLoader-style batching for single user/project/task lookups. load(id)
+# calls issued in the same event-loop tick (e.g. under one asyncio.gather) are
+# coalesced into one $in query, and every result is memoized for the rest of
+# the request, so handlers can look entities up one at a time without paying a
+# round-trip each. LoaderMiddleware gives every HTTP request its own set; code
+# running outside a request (scheduled jobs) gets a fresh, unshared set per
+# loaders() call, which still batches but never serves stale memoized docs.
+#
+# Memoized docs are what the collection held when first loaded: after writing
+# an entity, clear() it before loading it again in the same request.
+ENTITIES = {
+    "users": ("user_id", {"_id": 0, "password": 0}),
+    "projects": ("project_id", {"_id": 0}),
+    "tasks": ("task_id", {"_id": 0}),
+}
+BATCH_MAX = 1000  # ids per $in query
+
+
+class Loader:
+    def __init__(self, collection: str, key: str, projection: dict):
+        self.collection = collection
+        self.key = key
+        self.projection = projection
+        self._futures = {}   # id -> future of the doc (None if missing)
+        self._pending = []   # ids waiting for the next dispatch
+        self._fetches = set()  # in-flight query tasks, referenced so they aren't collected
+        self.stats = {"loads": 0, "queries": 0}
+
+    async def load(self, entity_id: str):
+        if not entity_id:
+            return None
+        self.stats["loads"] += 1
+        future = self._futures.get(entity_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._futures[entity_id] = future
+            if not self._pending:
+                # Runs after everything already scheduled this tick has had a chance to queue ids
+                asyncio.get_running_loop().call_soon(self._dispatch)
+            self._pending.append(entity_id)
+        # Shielded: one caller being cancelled mustn't cancel the lookup for everyone sharing it
+        return await asyncio.shield(future)
+
+    async def load_many(self, entity_ids) -> list:
+        """Docs in the order of entity_ids, None for ids that don't exist."""
+        return list(await asyncio.gather(*(self.load(entity_id) for entity_id in entity_ids)))
+
+    def clear(self, *entity_ids: str):
+        for entity_id in entity_ids:
+            future = self._futures.get(entity_id)
+            # A lookup still in flight keeps its future; it resolves to the pre-write doc
+            if future is not None and future.done():
+                del self._futures[entity_id]
+
+    def _dispatch(self):
+        ids, self._pending = self._pending, []
+        for i in range(0, len(ids), BATCH_MAX):
+            task = asyncio.ensure_future(self._fetch(ids[i:i + BATCH_MAX]))
+            self._fetches.add(task)
+            task.add_done_callback(self._fetches.discard)
+
+    async def _fetch(self, ids: list):
+        self.stats["queries"] += 1
+        futures = [self._futures[entity_id] for entity_id in ids]
+        try:
+            docs = await db[self.collection].find({self.key: {"$in": ids}}, self.projection).to_list(None)
+        except Exception as e:
+            for entity_id, future in zip(ids, futures):
+                # Failures aren't memoized; the next load retries
+                if self._futures.get(entity_id) is future:
+                    del self._futures[entity_id]
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {d[self.key]: d for d in docs}
+        for entity_id, future in zip(ids, futures):
+            if not future.done():
+                future.set_result(found.get(entity_id))
+
+
+class Loaders:
+    def __init__(self):
+        for collection, (key, projection) in ENTITIES.items():
+            setattr(self, collection, Loader(collection, key, projection))
+
+
+_current = contextvars.ContextVar("loaders", default=None)
+
+
+def loaders() -> Loaders:
+    return _current.get() or Loaders()
+
+
+class LoaderMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _current.set(Loaders())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,194 @@
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from database import db
+from models import gen_id
+from helpers import build_notification, insert_notifications
+from email_outbox import enqueue_emails
+
+logger = logging.getLogger(__name__)
+
+# The first notification of a type for a recipient is delivered right away and
+# opens a DIGEST_WINDOW_SECONDS window (notification_windows). Anything else of
+# that type for that recipient arriving while the window is open waits in
+# notification_pending and goes out as a single notification (and a single
+# email) when the window ends, which opens the next one. Set the window to 0 to
+# always deliver immediately.
+DIGEST_WINDOW_SECONDS = int(os.environ.get('DIGEST_WINDOW_SECONDS', '60'))
+# Deliveries per recipient per hour; past this, items keep accumulating into a later digest
+DIGEST_MAX_PER_HOUR = int(os.environ.get('DIGEST_MAX_PER_HOUR', '12'))
+DIGEST_PREVIEW_ITEMS = 3
+# How long a flush owns the items it claimed; a flush that dies leaves them to be picked up again
+CLAIM_SECONDS = 60
+
+DIGEST_TITLES = {
+    "task_assigned": "New Tasks Assigned",
+    "project_update": "Project Updates",
+}
+
+_deliveries = defaultdict(deque)  # user_id -> monotonic times of recent deliveries
+
+
+async def queue_notifications(user_ids: list, notif_type: str, title: str, message: str,
+                              link: str = "", email: dict = None):
+    user_ids = list(dict.fromkeys(user_ids))
+    if DIGEST_WINDOW_SECONDS <= 0:
+        notifs = [build_notification(uid, notif_type, title, message, link) for uid in user_ids]
+        await insert_notifications(notifs)
+        if email:
+            await enqueue_emails([email])
+        return
+
+    now = datetime.now(timezone.utc)
+    immediate, queued = [], []
+    for uid in user_ids:
+        if _under_cap(uid) and await _open_window(uid, notif_type, now):
+            immediate.append(uid)
+        else:
+            queued.append(uid)
+
+    if immediate:
+        await insert_notifications([build_notification(uid, notif_type, title, message, link) for uid in immediate])
+        if email:
+            await enqueue_emails([email])
+        for uid in immediate:
+            _deliveries[uid].append(time.monotonic())
+
+    if queued:
+        await db.notification_pending.insert_many([{
+            "pending_id": gen_id("pend_"),
+            "user_id": uid,
+            "type": notif_type,
+            "title": title,
+            "message": message,
+            "link": link,
+            "email": email,
+            "created_at": now,
+        } for uid in queued], ordered=False)
+        # Hold the window open at least until this item is due to be flushed
+        await db.notification_windows.update_many(
+            {"user_id": {"$in": queued}, "type": notif_type},
+            {"$max": {"until": now + timedelta(seconds=DIGEST_WINDOW_SECONDS)}},
+        )
+
+
+async def _open_window(user_id: str, notif_type: str, now: datetime) -> bool:
+    """Open a window for the recipient and type unless one is already open.
+
+    The unique index makes this atomic across processes: while a window is
+    open the filter misses, and the upsert's insert fails on the duplicate key.
+    """
+    try:
+        await db.notification_windows.update_one(
+            {"user_id": user_id, "type": notif_type, "until": {"$lte": now}},
+            {"$set": {"until": now + timedelta(seconds=DIGEST_WINDOW_SECONDS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def _under_cap(user_id: str) -> bool:
+    recent = _deliveries[user_id]
+    cutoff = time.monotonic() - 3600
+    while recent and recent[0] < cutoff:
+        recent.popleft()
+    return len(recent) < DIGEST_MAX_PER_HOUR
+
+
+def digest_email(to: str, title: str, items: list) -> dict:
+    rows = "".join(
+        f'<li style="margin:0 0 8px;color:#fafafa;">{item["email"]["subject"]}</li>' for item in items
+    )
+    return {
+        "to": to,
+        "subject": f"{len(items)} {title}",
+        "html": f"""
+        <div style="font-family:Arial,sans-serif;padding:20px;background:#09090b;color:#fafafa;">
+            <h2 style="color:#6366f1;">{title}</h2>
+            <ul style="background:#18181b;padding:16px 32px;border-radius:8px;margin:12px 0;">{rows}</ul>
+        </div>""",
+    }
+
+
+def coalesce(user_id: str, notif_type: str, items: list) -> tuple:
+    items.sort(key=lambda i: i["created_at"])
+    emails = [i for i in items if i.get("email")]
+    if len(items) == 1:
+        item = items[0]
+        notif = build_notification(user_id, notif_type, item["title"], item["message"], item["link"])
+        return notif, [item["email"]] if emails else []
+
+    title = DIGEST_TITLES.get(notif_type, "Updates")
+    preview = "; ".join(i["message"] for i in items[:DIGEST_PREVIEW_ITEMS])
+    if len(items) > DIGEST_PREVIEW_ITEMS:
+        preview += f" and {len(items) - DIGEST_PREVIEW_ITEMS} more"
+    notif = build_notification(user_id, notif_type, f"{len(items)} {title}", preview, items[0]["link"])
+    notif["digest_count"] = len(items)
+
+    if len(emails) == 1:
+        return notif, [emails[0]["email"]]
+    return notif, [digest_email(emails[0]["email"]["to"], title, emails)] if emails else []
+
+
+async def flush_pending() -> int:
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=DIGEST_WINDOW_SECONDS)
+    unclaimed = {"$or": [{"claim_id": {"$exists": False}}, {"claimed_until": {"$lt": now}}]}
+    groups = await db.notification_pending.aggregate([
+        {"$match": unclaimed},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "type": "$type"},
+            "first": {"$min": "$created_at"},
+            "ids": {"$push": "$pending_id"},
+        }},
+        {"$match": {"first": {"$lte": cutoff}}},
+    ]).to_list(None)
+
+    ready = [g for g in groups if _under_cap(g["_id"]["user_id"])]
+    if not ready:
+        return 0
+
+    # Claim before delivering, re-checking in the update that nobody else has, so
+    # flushes running concurrently never deliver the same item twice
+    claim_id = gen_id("claim_")
+    await db.notification_pending.update_many(
+        {"pending_id": {"$in": [pid for g in ready for pid in g["ids"]]}, **unclaimed},
+        {"$set": {"claim_id": claim_id, "claimed_until": now + timedelta(seconds=CLAIM_SECONDS)}},
+    )
+    items = await db.notification_pending.find({"claim_id": claim_id}, {"_id": 0}).to_list(None)
+    if not items:
+        return 0
+    by_group = defaultdict(list)
+    for item in items:
+        by_group[(item["user_id"], item["type"])].append(item)
+
+    notifs, emails = [], []
+    for (user_id, notif_type), group in by_group.items():
+        notif, group_emails = coalesce(user_id, notif_type, group)
+        notifs.append(notif)
+        emails.extend(group_emails)
+        _deliveries[user_id].append(time.monotonic())
+
+    await insert_notifications(notifs)
+    await enqueue_emails(emails)
+    await db.notification_pending.delete_many({"claim_id": claim_id})
+    # Each digest opens the next window, so a steady stream goes out at most once per window
+    try:
+        await db.notification_windows.bulk_write([
+            UpdateOne({"user_id": user_id, "type": notif_type},
+                      {"$max": {"until": now + timedelta(seconds=DIGEST_WINDOW_SECONDS)}}, upsert=True)
+            for user_id, notif_type in by_group
+        ], ordered=False)
+    except BulkWriteError as e:
+        # A window opened concurrently by queue_notifications already covers the recipient
+        if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+            raise
+    if len(items) > len(notifs):
+        logger.info(f"Coalesced {len(items)} pending notifications into {len(notifs)}")
+    return len(notifs)
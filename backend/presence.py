@@ -0,0 +1,144 @@
+import json
+import os
+import time
+from models import gen_id
+from realtime import broker, channel_topic
+
+# Presence lives only in this process's memory and is never written to Mongo.
+# A socket counts as online until it goes IDLE_SECONDS without an "active"
+# heartbeat, and stops counting after TTL_SECONDS without any heartbeat until
+# it sends another. A user is present while any of their sockets counts.
+IDLE_SECONDS = int(os.environ.get('PRESENCE_IDLE_SECONDS', '60'))
+TTL_SECONDS = int(os.environ.get('PRESENCE_TTL_SECONDS', '90'))
+TYPING_SECONDS = int(os.environ.get('PRESENCE_TYPING_SECONDS', '6'))
+TICK_SECONDS = int(os.environ.get('PRESENCE_TICK_SECONDS', '2'))
+
+
+class PresenceService:
+    def __init__(self, broker):
+        self.broker = broker
+        # connection_id -> {"user_id", "channels", "last_seen", "last_active", "live"}
+        self._connections = {}
+        self._users = {}      # user_id -> {"connections": live connection_ids, "channels", "state"}
+        self._channels = {}   # channel_id -> set of present user_ids
+        self._typing = {}     # channel_id -> {user_id: expires_at}
+        self._dirty = set()   # channel_ids whose snapshot changed since the last tick
+
+    def connect(self, user_id: str, channel_ids: list) -> str:
+        """Register an open socket; the returned id is passed to every other call."""
+        connection_id = gen_id("conn_")
+        now = time.monotonic()
+        self._connections[connection_id] = {
+            "user_id": user_id, "channels": set(channel_ids), "last_seen": now, "last_active": now, "live": False,
+        }
+        self._attach(connection_id)
+        return connection_id
+
+    def disconnect(self, connection_id: str):
+        conn = self._connections.get(connection_id)
+        if not conn:
+            return
+        if conn["live"]:
+            self._detach(connection_id)
+        del self._connections[connection_id]
+
+    def _attach(self, connection_id: str):
+        conn = self._connections[connection_id]
+        conn["live"] = True
+        user_id = conn["user_id"]
+        entry = self._users.setdefault(user_id, {"connections": set(), "channels": set(), "state": "online"})
+        entry["connections"].add(connection_id)
+        for channel_id in conn["channels"] - entry["channels"]:
+            entry["channels"].add(channel_id)
+            self._channels.setdefault(channel_id, set()).add(user_id)
+            self._dirty.add(channel_id)
+
+    def _detach(self, connection_id: str):
+        # The user stays present wherever another of their live connections is
+        conn = self._connections[connection_id]
+        conn["live"] = False
+        user_id = conn["user_id"]
+        entry = self._users[user_id]
+        entry["connections"].discard(connection_id)
+        remaining = set().union(*(self._connections[c]["channels"] for c in entry["connections"]))
+        for channel_id in entry["channels"] - remaining:
+            members = self._channels.get(channel_id)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._channels[channel_id]
+            self._typing.get(channel_id, {}).pop(user_id, None)
+            self._dirty.add(channel_id)
+        entry["channels"] = remaining
+        if not entry["connections"]:
+            del self._users[user_id]
+
+    def heartbeat(self, connection_id: str, active: bool = True):
+        conn = self._connections.get(connection_id)
+        if not conn:
+            return
+        now = time.monotonic()
+        conn["last_seen"] = now
+        if active:
+            conn["last_active"] = now
+        if not conn["live"]:
+            # Expired by the TTL while the socket stayed open; it's back
+            self._attach(connection_id)
+
+    def typing(self, connection_id: str, channel_id: str):
+        conn = self._connections.get(connection_id)
+        if not conn or channel_id not in conn["channels"]:
+            return
+        self.heartbeat(connection_id)
+        typing = self._typing.setdefault(channel_id, {})
+        if conn["user_id"] not in typing:
+            self._dirty.add(channel_id)
+        typing[conn["user_id"]] = time.monotonic() + TYPING_SECONDS
+
+    def _state(self, entry: dict, now: float) -> str:
+        last_active = max(self._connections[c]["last_active"] for c in entry["connections"])
+        return "idle" if now - last_active > IDLE_SECONDS else "online"
+
+    def snapshot(self, channel_id: str) -> dict:
+        online, idle = [], []
+        for user_id in self._channels.get(channel_id, ()):
+            (idle if self._users[user_id]["state"] == "idle" else online).append(user_id)
+        return {"online": online, "idle": idle, "typing": list(self._typing.get(channel_id, {}))}
+
+    def tick(self) -> int:
+        """Expire stale state and publish one snapshot per changed channel.
+
+        Many heartbeats/typing pings inside one tick collapse into a single
+        broadcast per channel, so cost is bounded by channels changed per tick.
+        """
+        now = time.monotonic()
+        for connection_id, conn in self._connections.items():
+            # The connection itself is kept, so a later heartbeat brings it back
+            if conn["live"] and now - conn["last_seen"] > TTL_SECONDS:
+                self._detach(connection_id)
+        for entry in self._users.values():
+            state = self._state(entry, now)
+            if state != entry["state"]:
+                entry["state"] = state
+                self._dirty.update(entry["channels"])
+
+        for channel_id, typing in list(self._typing.items()):
+            for user_id, expires_at in list(typing.items()):
+                if expires_at < now:
+                    del typing[user_id]
+                    self._dirty.add(channel_id)
+            if not typing:
+                del self._typing[channel_id]
+
+        dirty, self._dirty = self._dirty, set()
+        for channel_id in dirty:
+            event = {"type": "presence", "channel_id": channel_id, **self.snapshot(channel_id)}
+            self.broker.publish(channel_topic(channel_id), json.dumps(event))
+        return len(dirty)
+
+
+presence = PresenceService(broker)
+
+
+async def broadcast_presence():
+    presence.tick()
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.environ.get('REALTIME_QUEUE_SIZE', '256'))
+
+# Pushed to a subscription once it has been evicted so the consumer wakes up and disconnects
+EVICTED = object()
+
+
+def channel_topic(channel_id: str) -> str:
+    return f"chat:{channel_id}"
+
+
+def user_topic(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def notification_topic(user_id: str) -> str:
+    return f"notifications:{user_id}"
+
+
+class SlowConsumer(Exception):
+    pass
+
+
+class Subscription:
+    """One connection's bounded inbox. Messages are delivered in publish order."""
+
+    def __init__(self, broker, maxsize: int):
+        self.broker = broker
+        self.topics = set()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.evicted = False
+
+    async def get(self):
+        item = await self.queue.get()
+        if item is EVICTED:
+            raise SlowConsumer()
+        return item
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """In-process topic fan-out.
+
+    Publishing never awaits: each subscriber has a bounded queue and a subscriber
+    whose queue is full is evicted instead of slowing everyone else down.
+    Messages should be pre-serialized by the publisher so fan-out to N
+    connections encodes the payload once, not N times.
+    """
+
+    def __init__(self):
+        self._topics = {}
+        self.published = 0
+        self.delivered = 0
+        self.evictions = 0
+
+    def subscribe(self, topics, maxsize: int = QUEUE_SIZE) -> Subscription:
+        sub = Subscription(self, maxsize)
+        for topic in topics:
+            self._add(sub, topic)
+        return sub
+
+    def _add(self, sub: Subscription, topic: str):
+        sub.topics.add(topic)
+        self._topics.setdefault(topic, set()).add(sub)
+
+    def attach(self, source_topic: str, topic: str):
+        """Subscribe everyone currently listening on source_topic to topic as well,
+        e.g. put a user's open connections on a channel created after they connected."""
+        for sub in list(self._topics.get(source_topic, ())):
+            self._add(sub, topic)
+
+    def unsubscribe(self, sub: Subscription):
+        for topic in sub.topics:
+            subs = self._topics.get(topic)
+            if subs is None:
+                continue
+            subs.discard(sub)
+            if not subs:
+                del self._topics[topic]
+        sub.topics = set()
+
+    def publish(self, topic: str, message) -> int:
+        self.published += 1
+        delivered = 0
+        for sub in list(self._topics.get(topic, ())):
+            try:
+                sub.queue.put_nowait(message)
+                delivered += 1
+            except asyncio.QueueFull:
+                self._evict(sub)
+        self.delivered += delivered
+        return delivered
+
+    def _evict(self, sub: Subscription):
+        logger.warning(f"Evicting slow consumer subscribed to {len(sub.topics)} topics")
+        self.unsubscribe(sub)
+        sub.evicted = True
+        self.evictions += 1
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(EVICTED)
+
+    def stats(self) -> dict:
+        return {
+            "topics": len(self._topics),
+            "subscriptions": len({s for subs in self._topics.values() for s in subs}),
+            "published": self.published,
+            "delivered": self.delivered,
+            "evictions": self.evictions,
+        }
+
+
+broker = Broker()
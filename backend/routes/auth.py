@@ -2,7 +2,9 @@ from fastapi import APIRouter, HTTPException, Request, Response
 from datetime import datetime, timezone, timedelta
 from database import db
 from models import UserRegister, UserLogin, UserResponse, TokenResponse, gen_id
-from auth_utils import hash_password, verify_password, create_token, get_current_user
+from auth_utils import hash_password, verify_password, create_token, create_connection_ticket, get_current_user, CONNECTION_TICKET_SECONDS
+from ai_context import snapshot
+from user_search import user_index
 import requests
 import logging
 
@@ -29,6 +31,8 @@ async def register(data: UserRegister):
         "created_at": now,
     }
     await db.users.insert_one(user_doc)
+    snapshot.invalidate("users", user_id)
+    user_index.invalidate(user_id)
 
     token = create_token(user_id, data.email, data.role, data.name)
     user_resp = UserResponse(
@@ -99,6 +103,8 @@ async def process_session(request: Request, response: Response):
             "department": None,
             "created_at": datetime.now(timezone.utc).isoformat(),
         })
+    snapshot.invalidate("users", user_id)
+    user_index.invalidate(user_id)
 
     # Store session
     await db.user_sessions.insert_one({
@@ -135,6 +141,13 @@ async def get_me(request: Request):
     return {k: v for k, v in user.items() if k != "password"}
 
 
+@router.post("/connection-ticket")
+async def connection_ticket(request: Request):
+    """Short-lived credential for the chat socket and notification stream, passed as ?ticket="""
+    user = await get_current_user(request)
+    return {"ticket": create_connection_ticket(user["user_id"]), "expires_in": CONNECTION_TICKET_SECONDS}
+
+
 @router.post("/logout")
 async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
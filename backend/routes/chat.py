@@ -1,11 +1,27 @@
-from fastapi import APIRouter, Request
+import asyncio
+import json
+import os
+from fastapi import APIRouter, Request, Response, WebSocket, HTTPException
 from datetime import datetime, timezone
 from database import db
 from models import MessageCreate, gen_id
-from auth_utils import get_current_user
+from auth_utils import get_current_user, get_connection_user
+from realtime import broker, SlowConsumer, channel_topic, user_topic
+from chat_storage import read_messages
+from presence import presence
+from helpers import encode_cursor, decode_cursor
+from loaders import loaders
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
+MAX_PAGE_SIZE = int(os.environ.get('CHAT_MAX_PAGE_SIZE', '100'))
+
+
+def publish_channel_created(channel: dict):
+    # Put members' open sockets on the new channel without making them reconnect
+    for member_id in channel.get("members", []):
+        broker.attach(user_topic(member_id), channel_topic(channel["channel_id"]))
+
 
 @router.get("/channels")
 async def list_channels(request: Request):
@@ -27,23 +43,36 @@ async def list_channels(request: Request):
         if dm["channel_id"] not in all_ids:
             channels.append(dm)
 
-    # Add last message and unread count for each channel
+    # Add last message and who is around for each channel
     for ch in channels:
-        last_msg = await db.chat_messages.find(
-            {"channel_id": ch["channel_id"]}, {"_id": 0}
-        ).sort("created_at", -1).limit(1).to_list(1)
+        last_msg = await read_messages(ch["channel_id"], 1)
         ch["last_message"] = last_msg[0] if last_msg else None
+        ch["presence"] = presence.snapshot(ch["channel_id"])
 
     return channels
 
 
 @router.get("/messages/{channel_id}")
-async def get_messages(channel_id: str, request: Request, limit: int = 50):
+async def get_messages(channel_id: str, request: Request, response: Response,
+                       limit: int = 50, before: str = None, after: str = None):
     await get_current_user(request)
-    messages = await db.chat_messages.find(
-        {"channel_id": channel_id}, {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
-    messages.reverse()
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    messages = await read_messages(
+        channel_id, limit,
+        before=decode_cursor(before) if before else None,
+        after=decode_cursor(after) if after else None,
+    )
+
+    # Page through history with ?before=X-Before-Cursor, poll for new messages with ?after=X-After-Cursor
+    if messages:
+        response.headers["X-Before-Cursor"] = encode_cursor(messages[0]["created_at"], messages[0]["message_id"])
+        response.headers["X-After-Cursor"] = encode_cursor(messages[-1]["created_at"], messages[-1]["message_id"])
+    elif after:
+        response.headers["X-After-Cursor"] = after
+    response.headers["X-Has-More"] = "true" if len(messages) == limit else "false"
     return messages
 
 
@@ -62,7 +91,67 @@ async def send_message(data: MessageCreate, request: Request):
         "created_at": now,
     }
     await db.chat_messages.insert_one(message)
-    return {k: v for k, v in message.items() if k != "_id"}
+    message = {k: v for k, v in message.items() if k != "_id"}
+    broker.publish(channel_topic(data.channel_id), json.dumps({"type": "message", "message": message}))
+    return message
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    try:
+        user = await get_connection_user(websocket)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    if user["role"] == "admin":
+        query = {}
+    else:
+        query = {"members": user["user_id"]}
+    channels = await db.chat_channels.find(query, {"_id": 0, "channel_id": 1, "members": 1}).to_list(None)
+
+    await websocket.accept()
+    topics = [user_topic(user["user_id"])] + [channel_topic(c["channel_id"]) for c in channels]
+    sub = broker.subscribe(topics)
+    # Admins can read every channel but only show up as present where they are members
+    connection_id = presence.connect(user["user_id"], [c["channel_id"] for c in channels if user["user_id"] in c.get("members", [])])
+
+    async def pump():
+        while True:
+            await websocket.send_text(await sub.get())
+
+    async def receive():
+        while True:
+            try:
+                event = json.loads(await websocket.receive_text())
+            except ValueError:
+                continue
+            # Malformed frames are skipped rather than allowed to drop the socket
+            if not isinstance(event, dict):
+                continue
+            if event.get("type") == "heartbeat":
+                presence.heartbeat(connection_id, active=event.get("active", True))
+            elif event.get("type") == "typing" and isinstance(event.get("channel_id"), str):
+                presence.typing(connection_id, event["channel_id"])
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(receive())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            # Anything other than eviction means the socket is already gone
+            if isinstance(task.exception(), SlowConsumer):
+                await websocket.close(code=1013)
+    finally:
+        for task in tasks:
+            task.cancel()
+        sub.close()
+        presence.disconnect(connection_id)
+
+
+@router.get("/presence/{channel_id}")
+async def channel_presence(channel_id: str, request: Request):
+    await get_current_user(request)
+    return {"channel_id": channel_id, **presence.snapshot(channel_id)}
 
 
 @router.post("/dm/{target_user_id}")
@@ -72,13 +161,15 @@ async def create_dm_channel(target_user_id: str, request: Request):
     ids = sorted([user["user_id"], target_user_id])
     channel_id = f"dm_{ids[0]}_{ids[1]}"
 
-    existing = await db.chat_channels.find_one({"channel_id": channel_id}, {"_id": 0})
+    # The target is looked up alongside the channel, ready for when it has to be created
+    existing, target = await asyncio.gather(
+        db.chat_channels.find_one({"channel_id": channel_id}, {"_id": 0}),
+        loaders().users.load(target_user_id),
+    )
     if existing:
         return existing
 
-    target = await db.users.find_one({"user_id": target_user_id}, {"_id": 0, "password": 0})
     if not target:
-        from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="User not found")
 
     channel = {
@@ -93,4 +184,5 @@ async def create_dm_channel(target_user_id: str, request: Request):
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
     await db.chat_channels.insert_one(channel)
+    publish_channel_created(channel)
     return {k: v for k, v in channel.items() if k != "_id"}
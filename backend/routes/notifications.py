@@ -1,43 +1,119 @@
-from fastapi import APIRouter, Request
+import asyncio
+import json
+import os
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import StreamingResponse
 from database import db
-from auth_utils import get_current_user
+from auth_utils import get_current_user, get_connection_user
+from helpers import (
+    adjust_unread_count, get_unread_count, notification_expiry,
+    encode_cursor, decode_cursor, keyset_filter, sse_frame,
+)
+from realtime import broker, notification_topic, SlowConsumer
 
 router = APIRouter(prefix="/api/notifications", tags=["notifications"])
 
+STREAM_HEARTBEAT_SECONDS = int(os.environ.get('NOTIFY_STREAM_HEARTBEAT_SECONDS', '20'))
+STREAM_BACKFILL_LIMIT = 100
+MAX_PAGE_SIZE = 100
+
 
 @router.get("")
-async def list_notifications(request: Request):
+async def list_notifications(request: Request, response: Response,
+                             limit: int = MAX_PAGE_SIZE, before: str = None, read: bool = None):
     user = await get_current_user(request)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {"user_id": user["user_id"]}
+    if read is not None:
+        query["read"] = read
+    if before:
+        query.update(keyset_filter("created_at", "notification_id", decode_cursor(before), "$lt"))
+
     notifs = await db.notifications.find(
-        {"user_id": user["user_id"]}, {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+        query, {"_id": 0, "expires_at": 0}
+    ).sort([("created_at", -1), ("notification_id", -1)]).limit(limit).to_list(limit)
+
+    # Next page: ?before=X-Before-Cursor
+    if len(notifs) == limit:
+        response.headers["X-Before-Cursor"] = encode_cursor(notifs[-1]["created_at"], notifs[-1]["notification_id"])
+    response.headers["X-Has-More"] = "true" if len(notifs) == limit else "false"
     return notifs
 
 
 @router.get("/unread-count")
 async def unread_count(request: Request):
     user = await get_current_user(request)
-    count = await db.notifications.count_documents(
-        {"user_id": user["user_id"], "read": False}
-    )
-    return {"count": count}
+    return {"count": await get_unread_count(user["user_id"])}
+
+
+@router.get("/stream")
+async def notification_stream(request: Request):
+    user = await get_connection_user(request)
+    user_id = user["user_id"]
+    last_event_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+
+    async def events():
+        # Subscribe before reading the backlog so nothing published in between is lost
+        sub = broker.subscribe([notification_topic(user_id)])
+        try:
+            sent = set()
+            if last_event_id:
+                last = await db.notifications.find_one(
+                    {"notification_id": last_event_id, "user_id": user_id}, {"_id": 0, "created_at": 1}
+                )
+                if last:
+                    missed = await db.notifications.find(
+                        {"user_id": user_id, "created_at": {"$gt": last["created_at"]}}, {"_id": 0, "expires_at": 0}
+                    ).sort("created_at", 1).to_list(STREAM_BACKFILL_LIMIT)
+                    for notif in missed:
+                        sent.add(notif["notification_id"])
+                        yield sse_frame(notif["notification_id"], "notification", json.dumps(notif))
+
+            count = await get_unread_count(user_id)
+            yield "retry: 5000\n" + sse_frame(None, "unread", json.dumps({"count": count}))
+
+            while True:
+                try:
+                    event_id, event, data = await asyncio.wait_for(sub.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # The keep-alive carries the absolute count: notifications created by
+                    # another worker are never published to this one's broker
+                    count = await get_unread_count(user_id)
+                    yield sse_frame(None, "unread", json.dumps({"count": count}))
+                    continue
+                except SlowConsumer:
+                    return
+                if event_id in sent:
+                    continue
+                yield sse_frame(event_id, event, data)
+        finally:
+            sub.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
 
 
 @router.put("/{notification_id}/read")
 async def mark_read(notification_id: str, request: Request):
     user = await get_current_user(request)
-    await db.notifications.update_one(
-        {"notification_id": notification_id, "user_id": user["user_id"]},
-        {"$set": {"read": True}}
+    result = await db.notifications.update_one(
+        {"notification_id": notification_id, "user_id": user["user_id"], "read": False},
+        {"$set": {"read": True, "expires_at": notification_expiry(read=True)}}
     )
+    await adjust_unread_count(user["user_id"], -result.modified_count)
     return {"message": "Marked as read"}
 
 
 @router.put("/read-all")
 async def mark_all_read(request: Request):
     user = await get_current_user(request)
-    await db.notifications.update_many(
+    result = await db.notifications.update_many(
         {"user_id": user["user_id"], "read": False},
-        {"$set": {"read": True}}
+        {"$set": {"read": True, "expires_at": notification_expiry(read=True)}}
     )
+    await adjust_unread_count(user["user_id"], -result.modified_count)
     return {"message": "All marked as read"}
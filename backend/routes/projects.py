@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Depends, BackgroundTasks
+import asyncio
 from datetime import datetime, timezone
 from database import db
 from models import ProjectCreate, ProjectUpdate, MilestoneCreate, CommentCreate, gen_id
 from auth_utils import get_current_user, require_role
-from helpers import log_activity, notify_project_update
+from helpers import log_activity, notify_project_update, NOTIFY_INLINE_LIMIT
+from routes.chat import publish_channel_created
+from chat_storage import delete_channel_messages
+from ai_context import snapshot
+from loaders import loaders
+from storage import delete_files
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
 
@@ -49,17 +55,20 @@ async def create_project(data: ProjectCreate, request: Request):
         "updated_at": now,
     }
     await db.projects.insert_one(project)
+    snapshot.invalidate("projects", project_id)
     await log_activity(user["user_id"], user["name"], "created", "project", project_id, data.name)
 
     # Create default chat channel for this project
-    await db.chat_channels.insert_one({
+    channel = {
         "channel_id": f"proj_{project_id}",
         "name": data.name,
         "type": "project",
         "project_id": project_id,
         "members": members,
         "created_at": now,
-    })
+    }
+    await db.chat_channels.insert_one(channel)
+    publish_channel_created(channel)
 
     result = await db.projects.find_one({"project_id": project_id}, {"_id": 0})
     return result
@@ -72,27 +81,24 @@ async def get_project(project_id: str, request: Request):
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    # Get task counts
-    tasks = await db.tasks.find({"project_id": project_id}, {"_id": 0}).to_list(1000)
+    # Task counts and team member details in parallel
+    tasks, members = await asyncio.gather(
+        db.tasks.find({"project_id": project_id}, {"_id": 0}).to_list(1000),
+        loaders().users.load_many(project.get("team_members") or []),
+    )
     total = len(tasks)
     completed = sum(1 for t in tasks if t.get("status") == "completed")
     in_progress = sum(1 for t in tasks if t.get("status") == "in_progress")
     todo = total - completed - in_progress
     project["task_stats"] = {"total": total, "completed": completed, "in_progress": in_progress, "todo": todo}
-
-    # Get team member details
     if project.get("team_members"):
-        members = await db.users.find(
-            {"user_id": {"$in": project["team_members"]}},
-            {"_id": 0, "password": 0}
-        ).to_list(100)
-        project["team_details"] = members
+        project["team_details"] = [m for m in members if m]
 
     return project
 
 
 @router.put("/{project_id}")
-async def update_project(project_id: str, data: ProjectUpdate, request: Request):
+async def update_project(project_id: str, data: ProjectUpdate, request: Request, background_tasks: BackgroundTasks):
     user = await require_role(["admin", "project_manager"])(request)
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
     if not update_data:
@@ -100,6 +106,7 @@ async def update_project(project_id: str, data: ProjectUpdate, request: Request)
 
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     await db.projects.update_one({"project_id": project_id}, {"$set": update_data})
+    snapshot.invalidate("projects", project_id)
 
     project = await db.projects.find_one({"project_id": project_id}, {"_id": 0})
     if not project:
@@ -109,7 +116,10 @@ async def update_project(project_id: str, data: ProjectUpdate, request: Request)
 
     # Notify team
     others = [m for m in project.get("team_members", []) if m != user["user_id"]]
-    await notify_project_update(project, others, user["name"], "made updates")
+    if len(others) > NOTIFY_INLINE_LIMIT:
+        background_tasks.add_task(notify_project_update, project, others, user["name"], "made updates")
+    else:
+        await notify_project_update(project, others, user["name"], "made updates")
 
     return project
 
@@ -121,11 +131,17 @@ async def delete_project(project_id: str, request: Request):
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    task_ids = await db.tasks.distinct("task_id", {"project_id": project_id})
     await db.projects.delete_one({"project_id": project_id})
     await db.tasks.delete_many({"project_id": project_id})
+    snapshot.invalidate_all()
     await db.milestones.delete_many({"project_id": project_id})
     await db.chat_channels.delete_one({"channel_id": f"proj_{project_id}"})
-    await db.chat_messages.delete_many({"channel_id": f"proj_{project_id}"})
+    await delete_channel_messages(f"proj_{project_id}")
+    await delete_files({"$or": [
+        {"entity_type": "project", "entity_id": project_id},
+        {"entity_type": "task", "entity_id": {"$in": task_ids}},
+    ]})
     await log_activity(user["user_id"], user["name"], "deleted", "project", project_id, project["name"])
     return {"message": "Project deleted"}
 
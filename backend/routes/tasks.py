@@ -1,9 +1,13 @@
 from fastapi import APIRouter, HTTPException, Request
+import asyncio
 from datetime import datetime, timezone
 from database import db
 from models import TaskCreate, TaskUpdate, gen_id
 from auth_utils import get_current_user, require_role
 from helpers import log_activity, notify_task_assigned, create_notification
+from ai_context import snapshot
+from loaders import loaders
+from storage import delete_files
 
 router = APIRouter(prefix="/api/tasks", tags=["tasks"])
 
@@ -36,8 +40,12 @@ async def list_tasks(request: Request, project_id: str = None, status: str = Non
 async def create_task(data: TaskCreate, request: Request):
     user = await require_role(["admin", "project_manager"])(request)
 
-    # Verify project exists
-    project = await db.projects.find_one({"project_id": data.project_id}, {"_id": 0})
+    # Verify project exists; the assignee is looked up alongside it
+    lookups = loaders()
+    project, assignee = await asyncio.gather(
+        lookups.projects.load(data.project_id),
+        lookups.users.load(data.assigned_to),
+    )
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
@@ -61,13 +69,12 @@ async def create_task(data: TaskCreate, request: Request):
     }
 
     # Get assignee name
-    if data.assigned_to:
-        assignee = await db.users.find_one({"user_id": data.assigned_to}, {"_id": 0})
-        if assignee:
-            task["assigned_to_name"] = assignee["name"]
-            await notify_task_assigned(task, assignee, user["name"])
+    if assignee:
+        task["assigned_to_name"] = assignee["name"]
+        await notify_task_assigned(task, assignee, user["name"])
 
     await db.tasks.insert_one(task)
+    snapshot.invalidate("tasks", task_id)
     await log_activity(user["user_id"], user["name"], "created", "task", task_id, data.title, data.project_id)
 
     result = await db.tasks.find_one({"task_id": task_id}, {"_id": 0})
@@ -106,7 +113,7 @@ async def update_task(task_id: str, data: TaskUpdate, request: Request):
 
     # Handle reassignment
     if "assigned_to" in update_data and update_data["assigned_to"] != task.get("assigned_to"):
-        assignee = await db.users.find_one({"user_id": update_data["assigned_to"]}, {"_id": 0})
+        assignee = await loaders().users.load(update_data["assigned_to"])
         if assignee:
             update_data["assigned_to_name"] = assignee["name"]
             await notify_task_assigned(task, assignee, user["name"])
@@ -123,6 +130,7 @@ async def update_task(task_id: str, data: TaskUpdate, request: Request):
             )
 
     await db.tasks.update_one({"task_id": task_id}, {"$set": update_data})
+    snapshot.invalidate("tasks", task_id)
     await log_activity(user["user_id"], user["name"], "updated", "task", task_id, task["title"], task.get("project_id", ""))
 
     result = await db.tasks.find_one({"task_id": task_id}, {"_id": 0})
@@ -137,6 +145,8 @@ async def delete_task(task_id: str, request: Request):
         raise HTTPException(status_code=404, detail="Task not found")
 
     await db.tasks.delete_one({"task_id": task_id})
+    snapshot.invalidate("tasks", task_id)
     await db.comments.delete_many({"entity_type": "task", "entity_id": task_id})
+    await delete_files({"entity_type": "task", "entity_id": task_id})
     await log_activity(user["user_id"], user["name"], "deleted", "task", task_id, task["title"], task.get("project_id", ""))
     return {"message": "Task deleted"}
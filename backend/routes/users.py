@@ -1,20 +1,51 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Response
+from urllib.parse import quote
 from database import db
 from models import gen_id
 from auth_utils import get_current_user, require_role, hash_password
-from helpers import log_activity
+from helpers import log_activity, encode_cursor, decode_cursor, keyset_filter
+from ai_context import snapshot
+from user_search import user_index, SEARCH_LIMIT_MAX
+from loaders import loaders
+from storage import (
+    receive_upload, upload_usage, store_blob, link_blob, unref_blobs, safe_filename, download_url,
+    parse_range, BlobResponse, UPLOAD_ROOT, USER_UPLOAD_QUOTA_BYTES,
+)
+from collections import Counter
 from datetime import datetime, timezone
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
 
+# Enough for pickers and the user table; get_user returns the full profile
+LIST_PROJECTION = {"_id": 0, "user_id": 1, "name": 1, "email": 1, "role": 1, "picture": 1, "department": 1, "created_at": 1}
+
+
 @router.get("")
-async def list_users(request: Request):
-    user = await get_current_user(request)
-    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(500)
+async def list_users(request: Request, response: Response, limit: int = 500, after: str = None, ids: str = None):
+    await get_current_user(request)
+    if ids:
+        # ?ids=a,b,c resolves a batch of users (e.g. avatars) in one call, in the order asked
+        wanted = list(dict.fromkeys(i for i in ids.split(",") if i))[:500]
+        users = await loaders().users.load_many(wanted)
+        return [{k: u[k] for k in LIST_PROJECTION if k in u} for u in users if u]
+    limit = max(1, min(limit, 500))
+    query = keyset_filter("name", "user_id", decode_cursor(after), "$gt") if after else {}
+    users = await db.users.find(query, LIST_PROJECTION).sort([("name", 1), ("user_id", 1)]).to_list(limit + 1)
+    has_more = len(users) > limit
+    users = users[:limit]
+    if has_more:
+        response.headers["X-After-Cursor"] = encode_cursor(users[-1]["name"], users[-1]["user_id"])
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     return users
 
 
+@router.get("/search")
+async def search_users(request: Request, q: str = "", limit: int = 20):
+    await get_current_user(request)
+    return await user_index.search(q, max(1, min(limit, SEARCH_LIMIT_MAX)))
+
+
 @router.get("/{user_id}")
 async def get_user(user_id: str, request: Request):
     await get_current_user(request)
@@ -45,6 +76,8 @@ async def update_user(user_id: str, request: Request):
         raise HTTPException(status_code=400, detail="No valid fields")
 
     await db.users.update_one({"user_id": user_id}, {"$set": update_data})
+    snapshot.invalidate("users", user_id)
+    user_index.invalidate(user_id)
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0})
     return user
 
@@ -60,6 +93,8 @@ async def delete_user(user_id: str, request: Request):
         raise HTTPException(status_code=404, detail="User not found")
 
     await db.users.delete_one({"user_id": user_id})
+    snapshot.invalidate("users", user_id)
+    user_index.invalidate(user_id)
     await db.user_sessions.delete_many({"user_id": user_id})
     await log_activity(admin["user_id"], admin["name"], "deleted user", "user", user_id, user["name"])
     return {"message": "User deleted"}
@@ -106,45 +141,69 @@ async def list_comments(entity_type: str, entity_id: str, request: Request):
 
 @router.post("/files/upload")
 async def upload_file(request: Request):
-    from fastapi import UploadFile, File, Form
-    import aiofiles
-    import os
-
     user = await get_current_user(request)
-    form = await request.form()
-    file = form.get("file")
-    entity_type = form.get("entity_type", "general")
-    entity_id = form.get("entity_id", "")
-
-    if not file:
-        raise HTTPException(status_code=400, detail="No file provided")
-
-    file_id = gen_id("file_")
-    filename = f"{file_id}_{file.filename}"
-    upload_dir = "/app/backend/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    filepath = os.path.join(upload_dir, filename)
-
-    async with aiofiles.open(filepath, "wb") as f:
-        content = await file.read()
-        await f.write(content)
-
+    upload = await receive_upload(request, await upload_usage(user["user_id"]))
+    try:
+        stored_name = await store_blob(upload)
+    finally:
+        await upload.discard()
+    return await _attach_file(
+        user, stored_name, upload.sha256, upload.size, upload.filename, upload.content_type,
+        upload.fields.get("entity_type", "general"), upload.fields.get("entity_id", ""),
+    )
+
+
+@router.post("/files/link")
+async def link_file(request: Request):
+    """Attach content the caller has uploaded before, by its sha256, without
+    sending it again. 404 means it isn't stored and has to be uploaded."""
+    user = await get_current_user(request)
+    body = await request.json()
+    sha256 = str(body.get("sha256", "")).lower()
+    if not sha256:
+        raise HTTPException(status_code=400, detail="sha256 required")
+
+    # Only content the caller already has, so a hash alone can't be used to fetch someone else's file
+    source = await db.files.find_one(
+        {"uploaded_by": user["user_id"], "sha256": sha256, "stored_name": {"$regex": "^blobs/"}}, {"_id": 0}
+    )
+    if not source:
+        raise HTTPException(status_code=404, detail="No stored file with that hash")
+    if await upload_usage(user["user_id"]) + source["size"] > USER_UPLOAD_QUOTA_BYTES:
+        raise HTTPException(status_code=413, detail="Upload quota exceeded")
+    if not await link_blob(sha256):
+        raise HTTPException(status_code=404, detail="No stored file with that hash")
+    return await _attach_file(
+        user, source["stored_name"], sha256, source["size"],
+        safe_filename(body.get("filename") or source["original_name"]), source["content_type"],
+        body.get("entity_type", "general"), body.get("entity_id", ""),
+    )
+
+
+async def _attach_file(user: dict, stored_name: str, sha256: str, size: int, filename: str,
+                       content_type: str, entity_type: str, entity_id: str) -> dict:
+    # The caller holds a ref on the blob for this attachment; it is given back if the insert fails
     file_doc = {
-        "file_id": file_id,
-        "original_name": file.filename,
-        "stored_name": filename,
+        "file_id": gen_id("file_"),
+        "original_name": filename,
+        "stored_name": stored_name,
         "entity_type": entity_type,
         "entity_id": entity_id,
         "uploaded_by": user["user_id"],
         "uploaded_by_name": user["name"],
-        "size": len(content),
-        "content_type": file.content_type or "application/octet-stream",
+        "size": size,
+        "sha256": sha256,
+        "content_type": content_type,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
-    await db.files.insert_one(file_doc)
+    try:
+        await db.files.insert_one(file_doc)
+    except Exception:
+        await unref_blobs(Counter([sha256]))
+        raise
 
-    await log_activity(user["user_id"], user["name"], "uploaded file", entity_type, entity_id, file.filename)
-    return {k: v for k, v in file_doc.items() if k != "_id"}
+    await log_activity(user["user_id"], user["name"], "uploaded file", entity_type, entity_id, filename)
+    return {**{k: v for k, v in file_doc.items() if k != "_id"}, "url": download_url(file_doc)}
 
 
 @router.get("/files/{entity_type}/{entity_id}")
@@ -153,4 +212,71 @@ async def list_files(entity_type: str, entity_id: str, request: Request):
     files = await db.files.find(
         {"entity_type": entity_type, "entity_id": entity_id}, {"_id": 0}
     ).sort("created_at", -1).to_list(100)
+    for f in files:
+        f["url"] = download_url(f)
     return files
+
+
+# Downloads are immutable: a file's URL carries its content hash, so clients may cache it forever
+DOWNLOAD_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+async def _can_access_entity(user: dict, entity_type: str, entity_id: str) -> bool:
+    # Mirrors what list_projects and list_tasks show each role
+    if user["role"] == "admin" or entity_type == "user":
+        return True
+    if entity_type == "project":
+        project = await loaders().projects.load(entity_id)
+        return bool(project) and (
+            user["user_id"] in project.get("team_members", []) or project.get("created_by") == user["user_id"]
+        )
+    if entity_type == "task":
+        task = await loaders().tasks.load(entity_id)
+        if not task:
+            return False
+        if user["user_id"] in (task.get("assigned_to"), task.get("created_by")):
+            return True
+        return await _can_access_entity(user, "project", task.get("project_id"))
+    return False
+
+
+@router.api_route("/files/download/{file_id}/{digest}", methods=["GET", "HEAD"])
+async def download_file(file_id: str, digest: str, request: Request):
+    user = await get_current_user(request)
+    file_doc = await db.files.find_one({"file_id": file_id}, {"_id": 0})
+    if not file_doc or digest != (file_doc.get("sha256") or file_id):
+        raise HTTPException(status_code=404, detail="File not found")
+    if file_doc["uploaded_by"] != user["user_id"] and not await _can_access_entity(
+        user, file_doc["entity_type"], file_doc["entity_id"]
+    ):
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": DOWNLOAD_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ]):
+        return Response(status_code=304, headers=headers)
+
+    path = UPLOAD_ROOT / file_doc["stored_name"]
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    headers.update({
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=utf-8''{quote(file_doc['original_name'])}",
+        "X-Content-Type-Options": "nosniff",
+    })
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    # If-Range: only honour the range if the client's copy is this content
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = parse_range(range_header, size)
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return BlobResponse(path, start, end, 206, headers, file_doc["content_type"])
+    return BlobResponse(path, 0, size - 1, 200, headers, file_doc["content_type"])
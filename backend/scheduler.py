@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from models import gen_id
+from leases import LeaseManager, save_run, find_run
+
+logger = logging.getLogger(__name__)
+
+# Periodic jobs run as tasks on the app's own event loop, so they share the
+# Motor client and everything else with the request handlers. A job never
+# overlaps itself: a tick (or manual trigger) that lands while the previous run
+# is still going is skipped and joins that run instead. Intervals get +/- a
+# fraction of jitter so multiple instances don't all fire at the same moment.
+#
+# Exclusive jobs (the default) also never overlap across processes: they only
+# run in the process holding the job's lease (see leases.py), and a run is
+# cancelled if the lease is lost mid-way. Jobs that act on per-process state,
+# like presence, pass exclusive=False and run everywhere.
+SCHEDULER_JITTER = float(os.environ.get('SCHEDULER_JITTER', '0.1'))
+RUN_HISTORY = 20  # finished runs kept per job for status lookups
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Job:
+    def __init__(self, name: str, func, seconds: float, jitter: float, run_at_start: bool, exclusive: bool):
+        self.name = name
+        self.func = func
+        self.seconds = seconds
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self.exclusive = exclusive
+        self.current = None  # run dict while a run is in progress
+        self.task = None     # the task running job.func for the current run
+        self.joined = []     # run ids queued by other processes that share the current run
+        self.history = deque(maxlen=RUN_HISTORY)
+        self.next_run_at = None
+        self.stats = {
+            "runs": 0, "failures": 0, "skipped": 0, "not_leader": 0, "lease_lost": 0,
+            "last_started_at": None, "last_duration": None, "last_error": None,
+            "duration_total": 0.0, "duration_max": 0.0,
+        }
+
+    def delay(self) -> float:
+        spread = self.seconds * self.jitter
+        return max(0.0, self.seconds + random.uniform(-spread, spread))
+
+
+class Scheduler:
+    def __init__(self, leases: LeaseManager = None):
+        self.leases = leases or LeaseManager()
+        self.jobs = {}
+        self._tasks = set()
+        self._shared_runs = set()  # run ids handed out by trigger(), kept in Mongo for lookups
+        self._started = False
+        self._leases_ready = asyncio.Event()
+
+    def add_job(self, func, seconds: float, name: str = None, jitter: float = SCHEDULER_JITTER,
+                run_at_start: bool = False, exclusive: bool = True) -> Job:
+        job = Job(name or func.__name__, func, seconds, jitter, run_at_start, exclusive)
+        self.jobs[job.name] = job
+        if self._started:
+            self._spawn(self._loop(job))
+        return job
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def start(self):
+        self._started = True
+        self._spawn(self._lease_loop())
+        for job in self.jobs.values():
+            self._spawn(self._loop(job))
+
+    async def stop(self):
+        self._started = False
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Let another process take over right away instead of waiting out the TTL
+        await self.leases.release_all()
+
+    def _can_run(self, job: Job) -> bool:
+        return not job.exclusive or self.leases.holds(job.name)
+
+    async def _lease_loop(self):
+        while True:
+            for job in [j for j in self.jobs.values() if j.exclusive]:
+                try:
+                    requested = await self.leases.keep(job.name)
+                except Exception:
+                    logger.exception(f"Lease renewal for {job.name} failed")
+                    continue
+                if job.task and not self.leases.holds(job.name):
+                    job.stats["lease_lost"] += 1
+                    job.task.cancel()
+                for run_id in requested:
+                    if job.current:
+                        # Already running here: the queued run resolves with this run's outcome
+                        job.joined.append(run_id)
+                        await self._save(self._joined_run(job.current, run_id))
+                    else:
+                        self._spawn(self._execute(job, self._new_run(job, "manual", run_id)))
+            self._leases_ready.set()
+            await asyncio.sleep(self.leases.renew_seconds)
+
+    async def _loop(self, job: Job):
+        await self._leases_ready.wait()
+        if job.run_at_start and self._can_run(job):
+            await self._execute(job, self._new_run(job, "startup"))
+        while True:
+            delay = job.delay()
+            job.next_run_at = time.time() + delay
+            await asyncio.sleep(delay)
+            if not self._can_run(job):
+                job.stats["not_leader"] += 1
+                continue
+            if job.current:
+                job.stats["skipped"] += 1
+                continue
+            await self._execute(job, self._new_run(job, "interval"))
+
+    def _new_run(self, job: Job, trigger: str, run_id: str = None) -> dict:
+        # Claimed synchronously, so nothing else can start the job in between
+        run = {
+            "run_id": run_id or gen_id("run_"), "job": job.name, "trigger": trigger,
+            "status": "running", "started_at": _now(), "finished_at": None,
+            "duration": None, "result": None, "error": None,
+            "fencing_token": self.leases.tokens.get(job.name),
+        }
+        job.current = run
+        job.joined = []
+        job.history.append(run)
+        return run
+
+    def _joined_run(self, run: dict, run_id: str) -> dict:
+        return {**run, "run_id": run_id, "trigger": "manual", "joined": run["run_id"]}
+
+    async def _execute(self, job: Job, run: dict) -> dict:
+        stats = job.stats
+        stats["last_started_at"] = run["started_at"]
+        if job.exclusive and run["trigger"] == "manual":
+            self._shared_runs.add(run["run_id"])
+        started = time.perf_counter()
+        job.task = asyncio.ensure_future(job.func())
+        try:
+            if run["run_id"] in self._shared_runs:
+                await self._save(run)
+            # wait() rather than await, so the lease loop cancelling job.task
+            # doesn't also cancel this job's loop
+            await asyncio.wait({job.task})
+            if job.task.cancelled():
+                run["status"] = "cancelled"
+                run["error"] = "Lease lost"
+                stats["last_error"] = run["error"]
+            elif job.task.exception() is not None:
+                e = job.task.exception()
+                logger.error(f"Scheduled job {job.name} failed", exc_info=e)
+                run["status"] = "failed"
+                run["error"] = str(e)
+                stats["failures"] += 1
+                stats["last_error"] = str(e)
+            else:
+                run["result"] = job.task.result()
+                run["status"] = "succeeded"
+        except asyncio.CancelledError:
+            job.task.cancel()
+            run["status"] = "cancelled"
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            run["duration"] = round(duration, 4)
+            run["finished_at"] = _now()
+            job.current = None
+            job.task = None
+            joined, job.joined = job.joined, []
+            stats["runs"] += 1
+            stats["last_duration"] = run["duration"]
+            stats["duration_total"] += duration
+            stats["duration_max"] = max(stats["duration_max"], duration)
+        if run["run_id"] in self._shared_runs:
+            self._shared_runs.discard(run["run_id"])
+            await self._save(run)
+        for run_id in joined:
+            await self._save(self._joined_run(run, run_id))
+        return run
+
+    async def _save(self, run: dict):
+        try:
+            await save_run(run)
+        except Exception:
+            logger.exception(f"Could not record job run {run['run_id']}")
+
+    async def trigger(self, name: str) -> dict:
+        """Start a run of the job now and return its run record without
+        waiting. If the job is already running here, that run is returned; if
+        another process holds the job's lease, the run is queued for it."""
+        job = self.jobs[name]
+        if job.current:
+            job.stats["skipped"] += 1
+            if job.exclusive and job.current["run_id"] not in self._shared_runs:
+                self._shared_runs.add(job.current["run_id"])
+                await save_run(job.current)
+            return job.current
+        if not self._can_run(job):
+            await self.leases.keep(name)
+        if self._can_run(job):
+            run = self._new_run(job, "manual")
+            self._spawn(self._execute(job, run))
+            return run
+
+        run = {
+            "run_id": gen_id("run_"), "job": name, "trigger": "manual", "status": "queued",
+            "started_at": None, "finished_at": None, "duration": None, "result": None, "error": None,
+        }
+        await save_run(run)
+        if not await self.leases.request_run(name, run["run_id"]):
+            run["status"] = "failed"
+            run["error"] = "No process holds the job lease"
+            await save_run(run)
+        return run
+
+    async def get_run(self, run_id: str):
+        for job in self.jobs.values():
+            for run in job.history:
+                if run["run_id"] == run_id:
+                    return run
+        return await find_run(run_id)
+
+    def snapshot(self) -> dict:
+        jobs = {}
+        for name, job in self.jobs.items():
+            stats = dict(job.stats)
+            stats["interval_seconds"] = job.seconds
+            stats["exclusive"] = job.exclusive
+            stats["leader"] = self.leases.holds(name) if job.exclusive else None
+            stats["running"] = job.current is not None
+            stats["duration_avg"] = round(stats["duration_total"] / stats["runs"], 4) if stats["runs"] else None
+            stats["next_run_at"] = (
+                datetime.fromtimestamp(job.next_run_at, timezone.utc).isoformat() if job.next_run_at else None
+            )
+            jobs[name] = stats
+        return {"process": self.leases.owner, "jobs": jobs}
+
+
+scheduler = Scheduler()
@@ -1,20 +1,26 @@
 # backend/server.py
-from fastapi import FastAPI, Body
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Body, Request, HTTPException
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
 from starlette.middleware.cors import CORSMiddleware
 import os
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
-from apscheduler.schedulers.background import BackgroundScheduler
 
 # Import ONLY the brain functions from your other file
-from agent_service import run_deadline_check, handle_ai_logic
+from agent_service import run_deadline_check, handle_ai_logic, stream_ai_logic
+from scheduler import scheduler
+from loaders import LoaderMiddleware
+from auth_utils import get_current_user
+from storage import init_storage
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 app = FastAPI(title="Enterprise PM System")
+app.add_middleware(LoaderMiddleware)
 
 # CORS Setup
 app.add_middleware(
@@ -23,12 +29,12 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', 'http://localhost:5173').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Before-Cursor", "X-After-Cursor", "X-Has-More",
+                    "ETag", "Content-Range", "Content-Disposition", "Accept-Ranges"],
 )
 
-# Mount uploads
-uploads_dir = ROOT_DIR / "uploads"
-uploads_dir.mkdir(exist_ok=True)
-app.mount("/api/uploads", StaticFiles(directory=str(uploads_dir)), name="uploads")
+# Uploaded files are served by /api/users/files/download, which checks permissions
+init_storage()
 
 # Include your existing routes
 from routes.auth import router as auth_router
@@ -48,37 +54,147 @@ app.include_router(dashboard_router)
 app.include_router(users_router)
 
 # AI Endpoints
+async def cancel_on_disconnect(request: Request, coro):
+    # Stop waiting on the LLM as soon as the browser goes away
+    task = asyncio.create_task(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=1)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            raise HTTPException(status_code=499, detail="Client closed request")
+
+
 @app.post("/api/ai/chat")
-async def chat_with_ai(payload: dict = Body(...)):
+async def chat_with_ai(request: Request, payload: dict = Body(...)):
+    from llm_client import LLMTimeout
     user_message = payload.get("message")
-    ai_response = await handle_ai_logic(user_message)
+    try:
+        ai_response = await cancel_on_disconnect(request, handle_ai_logic(user_message))
+    except LLMTimeout:
+        raise HTTPException(status_code=504, detail="The AI assistant took too long to respond")
     return {"reply": ai_response}
 
+
+@app.post("/api/ai/chat/stream")
+async def chat_with_ai_stream(request: Request, payload: dict = Body(...)):
+    # Server-sent events: "token" as the reply is generated, "tool" as each
+    # action completes, then "done" (or "error"). Starlette cancels the
+    # generator, and with it the LLM call, when the client disconnects.
+    from llm_client import LLMTimeout
+    from helpers import sse_frame
+    # Tool calls write tasks and projects, so this needs a signed-in user
+    await get_current_user(request)
+    user_message = payload.get("message")
+
+    async def events():
+        try:
+            async for event, data in stream_ai_logic(user_message):
+                yield sse_frame(None, event, json.dumps(data))
+        except LLMTimeout:
+            yield sse_frame(None, "error", json.dumps({"detail": "The AI assistant took too long to respond"}))
+        except Exception:
+            logging.exception("AI stream failed")
+            yield sse_frame(None, "error", json.dumps({"detail": "The AI assistant failed to respond"}))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.get("/api/ai/metrics")
+async def ai_metrics(request: Request):
+    await get_current_user(request)
+    from llm_client import llm
+    from ai_context import snapshot
+    from ai_cache import response_cache
+    return {
+        "llm": llm.snapshot(),
+        "context": {"version": snapshot.version, **snapshot.stats},
+        "cache": response_cache.snapshot(),
+    }
+
 @app.get("/api/ai/trigger-scan")
-async def manual_trigger():
-    # This lets you test the proactive part manually
-    run_deadline_check()
-    return {"message": "Agent is scanning tasks..."}
+async def manual_trigger(request: Request):
+    # This lets you test the proactive part manually; poll /api/ai/jobs/{run_id} for the outcome
+    await get_current_user(request)
+    run = await scheduler.trigger("deadline_check")
+    return {"message": "Agent is scanning tasks...", "job_id": run["run_id"], "status": run["status"]}
+
+
+@app.get("/api/ai/jobs")
+async def list_jobs(request: Request):
+    await get_current_user(request)
+    return scheduler.snapshot()
+
+
+@app.get("/api/ai/jobs/{run_id}")
+async def get_job_run(run_id: str, request: Request):
+    await get_current_user(request)
+    run = await scheduler.get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Job run not found")
+    return run
 
 # Startup logic
-scheduler = BackgroundScheduler()
+background_tasks = []
+
 
 @app.on_event("startup")
 async def startup():
     from database import db
     # Create your indexes
     await db.users.create_index("user_id", unique=True)
+    await db.users.create_index([("name", 1), ("user_id", 1)])
+    await db.chat_messages.create_index([("channel_id", 1), ("created_at", -1), ("message_id", -1)])
+    await db.chat_message_buckets.create_index("bucket_id", unique=True)
+    await db.chat_message_buckets.create_index([("channel_id", 1), ("last_at", -1), ("last_id", -1)])
+    await db.notification_counters.create_index("user_id", unique=True)
+    await db.notifications.create_index([("user_id", 1), ("read", 1), ("created_at", -1)])
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1), ("notification_id", -1)])
+    await db.notifications.create_index("expires_at", expireAfterSeconds=0)
+    from email_outbox import create_outbox_indexes, start_workers
+    await create_outbox_indexes()
+    await db.notification_pending.create_index("pending_id", unique=True)
+    await db.notification_pending.create_index([("user_id", 1), ("type", 1), ("created_at", 1)])
+    await db.notification_pending.create_index("claim_id", sparse=True)
+    await db.notification_windows.create_index([("user_id", 1), ("type", 1)], unique=True)
+    await db.notification_windows.create_index("until", expireAfterSeconds=0)
+    from deadline_scanner import create_deadline_indexes
+    await create_deadline_indexes()
+    from leases import create_lease_indexes
+    await create_lease_indexes()
+    from storage import create_storage_indexes, gc_blobs
+    await create_storage_indexes()
     # ... (rest of your existing indexes)
-    
-    # Start the Proactive AI Scheduler
-    scheduler.add_job(run_deadline_check, 'interval', minutes=30)
+
+    from chat_storage import compact_cold_messages
+    from presence import broadcast_presence, TICK_SECONDS
+    from helpers import reconcile_unread_counts, backfill_notification_expiry
+    from notification_digest import flush_pending
+    # Start the Proactive AI Scheduler and the other periodic jobs on this loop
+    scheduler.add_job(run_deadline_check, 1800, name="deadline_check")
+    scheduler.add_job(compact_cold_messages, 600)
+    # Presence lives in each process's memory, so every process broadcasts its own
+    scheduler.add_job(broadcast_presence, TICK_SECONDS, jitter=0, exclusive=False)
+    # Reconcile once right away so counters exist for notifications written before they did
+    scheduler.add_job(reconcile_unread_counts, 3600, run_at_start=True)
+    scheduler.add_job(flush_pending, 10)
+    scheduler.add_job(gc_blobs, 3600)
     scheduler.start()
 
+    background_tasks.append(asyncio.create_task(backfill_notification_expiry()))
+    background_tasks.extend(start_workers())
+
 @app.on_event("shutdown")
 async def shutdown():
     from database import client
+    await scheduler.stop()
+    for task in background_tasks:
+        task.cancel()
     client.close()
-    scheduler.shutdown()
 
 @app.get("/api")
 async def root():
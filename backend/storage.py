@@ -0,0 +1,403 @@
+import hashlib
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+import aiofiles
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+from pymongo import ReturnDocument, UpdateOne
+from python_multipart.multipart import MultipartParser, parse_options_header
+from database import db
+from models import gen_id
+
+logger = logging.getLogger(__name__)
+
+# Uploaded files live under one root, written by the upload route and served
+# by /api/users/files/download. Uploads are parsed straight off the request stream and
+# written to a partial file in fixed-size chunks while being hashed, so memory
+# per upload stays at about one chunk however large the file is; limits are
+# enforced as bytes arrive and the partial file is dropped if one is hit.
+#
+# File contents are stored once per SHA-256 under blobs/, whatever the name or
+# entity they were attached to. db.files keeps one doc per attachment naming
+# its blob, and db.file_blobs one doc per blob counting those attachments
+# ("refs"). Uploading content that is already stored, or linking it by hash,
+# only adds an attachment doc and a ref. When the last attachment goes (its
+# task or project was deleted) the blob is stamped unreferenced_at, and
+# gc_blobs() deletes it once it has stayed unreferenced for BLOB_GC_GRACE_SECONDS.
+UPLOAD_ROOT = Path(os.environ.get('UPLOAD_ROOT', Path(__file__).parent / "uploads"))
+PARTIAL_DIR = UPLOAD_ROOT / ".partial"
+BLOB_DIR = UPLOAD_ROOT / "blobs"
+BLOB_GC_GRACE_SECONDS = int(os.environ.get('BLOB_GC_GRACE_SECONDS', '3600'))
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', str(256 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_MB', '25')) * 1024 * 1024
+USER_UPLOAD_QUOTA_BYTES = int(os.environ.get('USER_UPLOAD_QUOTA_MB', '1024')) * 1024 * 1024
+MULTIPART_OVERHEAD_BYTES = 16 * 1024  # boundaries, part headers and small form fields
+PARTIAL_MAX_AGE_SECONDS = 3600
+
+
+def init_storage():
+    UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
+    PARTIAL_DIR.mkdir(exist_ok=True)
+    BLOB_DIR.mkdir(exist_ok=True)
+    # Leftovers from a crashed worker; recent ones may belong to another worker's upload
+    cutoff = time.time() - PARTIAL_MAX_AGE_SECONDS
+    for path in PARTIAL_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+
+def safe_filename(filename: str) -> str:
+    name = Path((filename or "").replace("\\", "/")).name.strip()
+    return name or "file"
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class StreamedUpload:
+    """A multipart upload with at most one file part, parsed incrementally.
+    Form fields end up in .fields; the file part is written to a partial file
+    whose size and sha256 are known once receive() returns."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.fields = {}
+        self.filename = None
+        self.content_type = None
+        self.size = 0
+        self.sha256 = None
+        self.partial_path = None
+        self._hash = hashlib.sha256()
+        self._file = None
+        self._buffer = bytearray()
+        self._part = None  # {"name", "data", "headers"} of the part being parsed
+        self._header_field = b""
+        self._header_value = b""
+        self._finished_file = False
+
+    # Parser callbacks: they only buffer, the file writes happen in receive()
+
+    def on_part_begin(self):
+        self._part = {"name": None, "headers": {}, "data": bytearray(), "file": False}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._part["headers"][self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._part["headers"].get(b"content-disposition", b""))
+        self._part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            if self.filename is not None:
+                raise HTTPException(status_code=400, detail="Only one file per upload")
+            self._part["file"] = True
+            self.filename = safe_filename(options[b"filename"].decode("utf-8", "replace"))
+            content_type = self._part["headers"].get(b"content-type", b"").decode("latin-1").strip()
+            self.content_type = content_type or "application/octet-stream"
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._part["file"]:
+            chunk = data[start:end]
+            self.size += len(chunk)
+            if self.size > self.limit:
+                raise UploadTooLarge()
+            self._hash.update(chunk)
+            self._buffer += chunk
+        else:
+            self._part["data"] += data[start:end]
+            if len(self._part["data"]) > MULTIPART_OVERHEAD_BYTES:
+                raise HTTPException(status_code=400, detail="Form field too large")
+
+    def on_part_end(self):
+        if self._part["file"]:
+            self._finished_file = True
+        else:
+            self.fields[self._part["name"]] = self._part["data"].decode("utf-8", "replace")
+
+    async def _flush(self, final: bool = False):
+        if self._buffer and (final or len(self._buffer) >= UPLOAD_CHUNK_BYTES):
+            if self._file is None:
+                self.partial_path = PARTIAL_DIR / gen_id("part_")
+                self._file = await aiofiles.open(self.partial_path, "wb")
+            await self._file.write(bytes(self._buffer))
+            self._buffer.clear()
+
+    async def receive(self, request: Request):
+        _, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+        parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                await self._flush(final=self._finished_file)
+            parser.finalize()
+            await self._flush(final=True)
+            if self.filename is not None and self._file is None:
+                # Empty file: nothing was buffered, but it still gets stored
+                self.partial_path = PARTIAL_DIR / gen_id("part_")
+                self._file = await aiofiles.open(self.partial_path, "wb")
+            self.sha256 = self._hash.hexdigest()
+        except BaseException:
+            await self.discard()
+            raise
+        finally:
+            if self._file is not None:
+                await self._file.close()
+
+    async def discard(self):
+        self._buffer.clear()
+        if self._file is not None:
+            await self._file.close()
+        if self.partial_path is not None:
+            try:
+                os.unlink(self.partial_path)
+            except FileNotFoundError:
+                pass
+            self.partial_path = None
+
+    def commit(self, path: Path):
+        """Move the received file to path, replacing whatever is there."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.partial_path, path)
+        self.partial_path = None
+
+
+async def receive_upload(request: Request, used_bytes: int) -> StreamedUpload:
+    """Stream a multipart upload to a partial file, enforcing MAX_UPLOAD_BYTES
+    and what is left of the user's USER_UPLOAD_QUOTA_BYTES. Raises 413 if
+    either is exceeded, before or while the body arrives."""
+    remaining = USER_UPLOAD_QUOTA_BYTES - used_bytes
+    limit = min(MAX_UPLOAD_BYTES, remaining)
+    if limit == remaining:
+        detail = f"Upload quota of {USER_UPLOAD_QUOTA_BYTES // (1024 * 1024)} MB exceeded"
+    else:
+        detail = f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+    if limit <= 0:
+        raise HTTPException(status_code=413, detail=detail)
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=detail)
+
+    upload = StreamedUpload(limit)
+    try:
+        await upload.receive(request)
+    except UploadTooLarge:
+        logger.info(f"Upload rejected after {upload.size} bytes: {detail}")
+        raise HTTPException(status_code=413, detail=detail)
+    if upload.filename is None:
+        raise HTTPException(status_code=400, detail="No file provided")
+    return upload
+
+
+def blob_name(sha256: str) -> str:
+    # Relative to UPLOAD_ROOT; fanned out so no directory gets too large
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+
+def download_url(file_doc: dict) -> str:
+    # Content-addressed, so a URL always names the same bytes and can be cached forever
+    digest = file_doc.get("sha256") or file_doc["file_id"]
+    return f"/api/users/files/download/{file_doc['file_id']}/{digest}"
+
+
+async def upload_usage(user_id: str) -> int:
+    usage = await db.files.aggregate([
+        {"$match": {"uploaded_by": user_id}},
+        {"$group": {"_id": None, "bytes": {"$sum": "$size"}}},
+    ]).to_list(1)
+    return usage[0]["bytes"] if usage else 0
+
+
+async def store_blob(upload: StreamedUpload) -> str:
+    """Take a ref on the blob for upload's content, storing the received file
+    as that blob unless it is already there. Returns the blob's stored name."""
+    before = await db.file_blobs.find_one_and_update(
+        {"sha256": upload.sha256},
+        {
+            "$inc": {"refs": 1},
+            "$unset": {"unreferenced_at": ""},
+            "$setOnInsert": {"size": upload.size, "created_at": datetime.now(timezone.utc).isoformat()},
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    name = blob_name(upload.sha256)
+    path = UPLOAD_ROOT / name
+    # An existing blob doc whose file is missing (say, lost to a crash) is healed with this copy
+    if before is None or not path.exists():
+        upload.commit(path)
+    return name
+
+
+async def link_blob(sha256: str) -> bool:
+    """Take a ref on an already stored blob. False if there is no such blob."""
+    blob = await db.file_blobs.find_one_and_update(
+        {"sha256": sha256},
+        {"$inc": {"refs": 1}, "$unset": {"unreferenced_at": ""}},
+    )
+    if blob is None:
+        return False
+    if not (UPLOAD_ROOT / blob_name(sha256)).exists():
+        await unref_blobs(Counter([sha256]))
+        return False
+    return True
+
+
+async def unref_blobs(counts: Counter):
+    """Drop refs per sha256; blobs left with none start their GC grace period."""
+    if not counts:
+        return
+    await db.file_blobs.bulk_write(
+        [UpdateOne({"sha256": sha}, {"$inc": {"refs": -n}}) for sha, n in counts.items()], ordered=False
+    )
+    await db.file_blobs.update_many(
+        {"sha256": {"$in": list(counts)}, "refs": {"$lte": 0}, "unreferenced_at": {"$exists": False}},
+        {"$set": {"unreferenced_at": datetime.now(timezone.utc)}},
+    )
+
+
+async def delete_files(query: dict) -> int:
+    """Delete the attachment docs matching query and release their blobs."""
+    files = await db.files.find(query, {"_id": 0, "file_id": 1, "stored_name": 1, "sha256": 1}).to_list(None)
+    if not files:
+        return 0
+    await db.files.delete_many({"file_id": {"$in": [f["file_id"] for f in files]}})
+    counts = Counter()
+    for f in files:
+        if f["stored_name"].startswith("blobs/"):
+            counts[f["sha256"]] += 1
+        else:
+            # Stored before blobs existed: one file per attachment
+            (UPLOAD_ROOT / f["stored_name"]).unlink(missing_ok=True)
+    await unref_blobs(counts)
+    return len(files)
+
+
+async def gc_blobs() -> dict:
+    """Delete blobs that have had no refs for BLOB_GC_GRACE_SECONDS."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=BLOB_GC_GRACE_SECONDS)
+    deleted = freed = 0
+    candidates = await db.file_blobs.find(
+        {"refs": {"$lte": 0}, "unreferenced_at": {"$lt": cutoff}}, {"_id": 0, "sha256": 1}
+    ).to_list(None)
+    for candidate in candidates:
+        sha = candidate["sha256"]
+        # Conditional, so a blob that was re-uploaded or linked since the find is kept
+        blob = await db.file_blobs.find_one_and_delete({"sha256": sha, "refs": {"$lte": 0}})
+        if blob is None:
+            continue
+        path = UPLOAD_ROOT / blob_name(sha)
+        trash = PARTIAL_DIR / gen_id("gc_")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            continue
+        # An upload that raced the delete above re-created the doc and may
+        # already have written its copy, which is what we just moved aside
+        if await db.file_blobs.find_one({"sha256": sha}, {"_id": 1}) and not path.exists():
+            os.rename(trash, path)
+            continue
+        trash.unlink()
+        deleted += 1
+        freed += blob.get("size", 0)
+    if deleted:
+        logger.info(f"Blob GC deleted {deleted} blobs, {freed} bytes")
+    return {"deleted": deleted, "bytes": freed}
+
+
+def parse_range(header: str, size: int):
+    """(start, end) inclusive for a single "bytes=" range, None to ignore the
+    header (malformed, last before first, or several ranges), or raise 416 if
+    it starts past the end of the file."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(0, size - suffix), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                raise ValueError
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class BlobResponse(Response):
+    """Sends bytes [start, end] of a stored file. Uses the ASGI zero-copy send
+    extension when the server offers it (or pathsend for whole files), and
+    falls back to reading the file in chunks otherwise."""
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        extensions = scope.get("extensions") or {}
+        if scope["method"] == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file.fileno(),
+                            "offset": self.start, "count": self.count})
+        elif "http.response.pathsend" in extensions and self.start == 0 and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            async with await anyio.open_file(self.path, "rb") as file:
+                await file.seek(self.start)
+                remaining = self.count
+                while remaining:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def create_storage_indexes():
+    await db.file_blobs.create_index("sha256", unique=True)
+    await db.file_blobs.create_index([("refs", 1), ("unreferenced_at", 1)])
+    await db.files.create_index([("uploaded_by", 1), ("sha256", 1)])
+    await db.files.create_index([("entity_type", 1), ("entity_id", 1), ("created_at", -1)])
@@ -0,0 +1,98 @@
+import bisect
+import os
+import re
+from database import db
+from collection_mirror import CollectionMirror
+
+# Typeahead over user names and emails for the assignee and DM pickers. Every
+# user is indexed under a few lowercase keys (each word of the name, the full
+# name, the email and its local part) kept in one sorted list, so a prefix
+# lookup is a bisect plus a short scan instead of a collection scan. Write
+# paths call invalidate() with the user ids they touched and the next search
+# patches just those; a periodic full reload picks up other processes' writes.
+USER_INDEX_REFRESH_SECONDS = int(os.environ.get('USER_INDEX_REFRESH_SECONDS', '300'))
+SEARCH_LIMIT_MAX = 50
+
+SEARCH_PROJECTION = {"_id": 0, "user_id": 1, "name": 1, "email": 1, "picture": 1, "role": 1}
+
+
+def index_keys(user: dict) -> set:
+    name = (user.get("name") or "").lower().strip()
+    email = (user.get("email") or "").lower().strip()
+    keys = {word for word in re.split(r"[\s.,'_-]+", name) if word}
+    keys.update((name, email, email.split("@")[0]))
+    keys.discard("")
+    return keys
+
+
+class UserIndex(CollectionMirror):
+    def __init__(self):
+        super().__init__(["users"], USER_INDEX_REFRESH_SECONDS)
+        self.users = {}      # user_id -> slim doc
+        self._keys = {}      # user_id -> keys it is indexed under
+        self._sorted = []    # sorted (key, user_id)
+        self.stats["searches"] = 0
+
+    def invalidate(self, *user_ids: str):
+        super().invalidate("users", *user_ids)
+
+    def _remove(self, user_id: str):
+        self.users.pop(user_id, None)
+        for key in self._keys.pop(user_id, ()):
+            i = bisect.bisect_left(self._sorted, (key, user_id))
+            if i < len(self._sorted) and self._sorted[i] == (key, user_id):
+                del self._sorted[i]
+
+    def _add(self, user: dict):
+        keys = index_keys(user)
+        self.users[user["user_id"]] = user
+        self._keys[user["user_id"]] = keys
+        for key in keys:
+            bisect.insort(self._sorted, (key, user["user_id"]))
+
+    async def _load(self):
+        docs = await db.users.find({}, SEARCH_PROJECTION).to_list(None)
+        self.users = {d["user_id"]: d for d in docs}
+        self._keys = {d["user_id"]: index_keys(d) for d in docs}
+        self._sorted = sorted((key, user_id) for user_id, keys in self._keys.items() for key in keys)
+
+    async def _patch(self, dirty: dict):
+        ids = dirty["users"]
+        docs = await db.users.find({"user_id": {"$in": list(ids)}}, SEARCH_PROJECTION).to_list(None)
+        for user_id in ids:
+            self._remove(user_id)
+        for doc in docs:
+            self._add(doc)
+
+    def _prefixed(self, prefix: str) -> set:
+        found = set()
+        i = bisect.bisect_left(self._sorted, (prefix, ""))
+        while i < len(self._sorted) and self._sorted[i][0].startswith(prefix):
+            found.add(self._sorted[i][1])
+            i += 1
+        return found
+
+    async def search(self, query: str, limit: int = 20) -> list:
+        """Users whose name or email words start with every term of the query,
+        full-name prefix matches first, then by name."""
+        await self.refresh()
+        self.stats["searches"] += 1
+        query = " ".join(query.lower().split())
+        terms = sorted(set(query.split()), key=len, reverse=True)
+        if not terms:
+            return []
+        # Scan for the longest term only; the rest are checked against each candidate's keys
+        matches = [
+            user_id for user_id in self._prefixed(terms[0])
+            if all(any(key.startswith(term) for key in self._keys[user_id]) for term in terms[1:])
+        ]
+
+        def rank(user_id):
+            user = self.users[user_id]
+            name = (user.get("name") or "").lower()
+            return (not name.startswith(query), name, user_id)
+
+        return [self.users[user_id] for user_id in sorted(matches, key=rank)[:limit]]
+
+
+user_index = UserIndex()
@@ -308,6 +308,28 @@ class EnterprisePMTester:
         result = response.json()
         return isinstance(result, list)
 
+    def test_chat_message_paging(self):
+        """Test cursor paging through chat history"""
+        channels_response = self.make_request('GET', 'chat/channels', token=self.admin_token)
+        if channels_response.status_code != 200 or not channels_response.json():
+            return True  # Skip if no channels
+
+        channel_id = channels_response.json()[0]['channel_id']
+        for i in range(3):
+            self.make_request('POST', 'chat/messages', {"content": f"Paging {i}", "channel_id": channel_id}, token=self.admin_token)
+
+        first = self.make_request('GET', f'chat/messages/{channel_id}', token=self.admin_token, params={"limit": 2})
+        if first.status_code != 200 or len(first.json()) != 2:
+            return False
+
+        cursor = first.headers.get('X-Before-Cursor')
+        older = self.make_request('GET', f'chat/messages/{channel_id}', token=self.admin_token, params={"limit": 2, "before": cursor})
+        if older.status_code != 200:
+            return False
+
+        first_ids = {m['message_id'] for m in first.json()}
+        return all(m['message_id'] not in first_ids for m in older.json())
+
     # ─── Comments Tests ───
     def test_create_comment(self):
         """Test creating comments"""
@@ -413,6 +435,7 @@ class EnterprisePMTester:
         self.run_test("Chat Channels", self.test_chat_channels)
         self.run_test("Send Chat Message", self.test_send_chat_message)
         self.run_test("Get Chat Messages", self.test_get_chat_messages)
+        self.run_test("Chat Message Paging", self.test_chat_message_paging)
 
         # Comments Tests
         self.log("\n💭 Testing Comments...")
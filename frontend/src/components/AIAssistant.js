@@ -4,7 +4,7 @@ import { Bot, X, Send, Loader2 } from 'lucide-react';
 import { Button } from './ui/button';
 import { Card, CardHeader, CardContent, CardFooter } from './ui/card';
 import { Input } from './ui/input';
-import api from '../lib/api';
+import { aiApi } from '../lib/api';
 
 export default function AIAssistant() {
   const [isOpen, setIsOpen] = useState(false);
@@ -13,6 +13,8 @@ export default function AIAssistant() {
     { role: 'ai', text: 'Hello! I can help you with project tasks and deadlines. What’s on your mind?' }
   ]);
   const [loading, setLoading] = useState(false);
+  // Stays true until the reply has finished streaming, after the spinner is gone
+  const [streaming, setStreaming] = useState(false);
   const scrollRef = useRef(null);
 
   // Auto-scroll to bottom of chat
@@ -23,20 +25,41 @@ export default function AIAssistant() {
   }, [messages]);
 
   const handleSend = async () => {
-    if (!input.trim() || loading) return;
+    if (!input.trim() || streaming) return;
 
     const userMsg = { role: 'user', text: input };
     setMessages(prev => [...prev, userMsg]);
     setInput('');
     setLoading(true);
+    setStreaming(true);
+
+    // Placeholder bubble that fills in as tokens arrive
+    const updateReply = (update) => setMessages(prev => {
+      const next = [...prev];
+      next[next.length - 1] = update(next[next.length - 1]);
+      return next;
+    });
+    setMessages(prev => [...prev, { role: 'ai', text: '', actions: [] }]);
 
     try {
-      const response = await api.post("/ai/chat", { message: input });
-      setMessages(prev => [...prev, { role: 'ai', text: response.data.reply }]);
+      await aiApi.chatStream(userMsg.text, (event, data) => {
+        if (event === 'token') {
+          setLoading(false);
+          updateReply(msg => ({ ...msg, text: msg.text + data.text }));
+        } else if (event === 'tool') {
+          setLoading(false);
+          updateReply(msg => ({ ...msg, actions: [...msg.actions, data] }));
+        } else if (event === 'done') {
+          updateReply(msg => ({ ...msg, text: data.reply }));
+        } else if (event === 'error') {
+          updateReply(msg => ({ ...msg, text: data.detail }));
+        }
+      });
     } catch (error) {
-      setMessages(prev => [...prev, { role: 'ai', text: "Sorry, I'm having trouble connecting to the server." }]);
+      updateReply(msg => ({ ...msg, text: "Sorry, I'm having trouble connecting to the server." }));
     } finally {
       setLoading(false);
+      setStreaming(false);
     }
   };
 
@@ -55,13 +78,18 @@ export default function AIAssistant() {
           </CardHeader>
           
           <CardContent ref={scrollRef} className="flex-1 overflow-y-auto p-4 space-y-4 bg-muted/30">
-            {messages.map((msg, i) => (
+            {messages.filter(msg => msg.text || msg.actions?.length).map((msg, i) => (
               <div key={i} className={`flex ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}>
                 <div className={`max-w-[85%] p-3 rounded-2xl text-sm ${
                   msg.role === 'user' 
                   ? 'bg-primary text-primary-foreground rounded-tr-none' 
                   : 'bg-card border rounded-tl-none shadow-sm'
                 }`}>
+                  {msg.actions?.map((action, j) => (
+                    <div key={j} className={`text-xs mb-1 ${action.ok ? 'text-muted-foreground' : 'text-destructive'}`}>
+                      {action.ok ? '✓' : '✗'} {action.summary}
+                    </div>
+                  ))}
                   {msg.text}
                 </div>
               </div>
@@ -85,7 +113,7 @@ export default function AIAssistant() {
                 onKeyPress={(e) => e.key === 'Enter' && handleSend()}
                 className="bg-muted/50 border-none focus-visible:ring-1"
               />
-              <Button size="icon" onClick={handleSend} disabled={loading}>
+              <Button size="icon" onClick={handleSend} disabled={streaming}>
                 <Send size={18} />
               </Button>
             </div>
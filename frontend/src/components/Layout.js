@@ -34,15 +34,42 @@ export default function Layout({ children }) {
   const [unreadCount, setUnreadCount] = useState(0);
 
   useEffect(() => {
-    const fetchUnread = async () => {
+    // The stream sends the current count on connect and with every keep-alive, and deltas in between
+    // for notifications created or read through this worker
+    let source;
+    let retryTimer;
+    let closed = false;
+    const connect = async () => {
       try {
-        const res = await notificationsApi.unreadCount();
-        setUnreadCount(res.data.count);
-      } catch {}
+        source = await notificationsApi.stream();
+      } catch {
+        if (!closed) retryTimer = setTimeout(connect, 5000);
+        return;
+      }
+      if (closed) {
+        source.close();
+        return;
+      }
+      source.addEventListener('unread', (e) => {
+        const data = JSON.parse(e.data);
+        if (data.count !== undefined) {
+          setUnreadCount(data.count);
+        } else {
+          setUnreadCount((c) => Math.max(0, c + data.delta));
+        }
+      });
+      // The browser reconnects with the same ticket, which is refused once it
+      // expires; start over with a fresh one when that happens
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED && !closed) retryTimer = setTimeout(connect, 5000);
+      };
+    };
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      source?.close();
     };
-    fetchUnread();
-    const interval = setInterval(fetchUnread, 15000);
-    return () => clearInterval(interval);
   }, []);
 
   const handleLogout = async () => {
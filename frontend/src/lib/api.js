@@ -40,11 +40,21 @@ export const authApi = {
   session: (sessionId) => api.post('/auth/session', { session_id: sessionId }),
   me: () => api.get('/auth/me'),
   logout: () => api.post('/auth/logout'),
+  connectionTicket: () => api.post('/auth/connection-ticket'),
+};
+
+// WebSocket and EventSource cannot send headers, so they authenticate with a
+// short-lived ticket in the query string instead of the login token
+const ticketQuery = async () => {
+  const res = await authApi.connectionTicket();
+  return `ticket=${encodeURIComponent(res.data.ticket)}`;
 };
 
 // Users
 export const usersApi = {
-  list: () => api.get('/users'),
+  list: (params) => api.get('/users', { params }),
+  getMany: (ids) => api.get('/users', { params: { ids: ids.join(',') } }),
+  search: (q, limit = 20) => api.get('/users/search', { params: { q, limit } }),
   get: (id) => api.get(`/users/${id}`),
   update: (id, data) => api.put(`/users/${id}`, data),
   delete: (id) => api.delete(`/users/${id}`),
@@ -74,15 +84,22 @@ export const tasksApi = {
 // Chat
 export const chatApi = {
   getChannels: () => api.get('/chat/channels'),
-  getMessages: (channelId, limit = 50) => api.get(`/chat/messages/${channelId}`, { params: { limit } }),
+  getMessages: (channelId, params = {}) => api.get(`/chat/messages/${channelId}`, { params: { limit: 50, ...params } }),
   sendMessage: (data) => api.post('/chat/messages', data),
   createDm: (userId) => api.post(`/chat/dm/${userId}`),
+  socket: async () => new WebSocket(
+    `${api.defaults.baseURL.replace(/^http/, 'ws')}/chat/ws?${await ticketQuery()}`,
+  ),
 };
 
 // Notifications
 export const notificationsApi = {
   list: () => api.get('/notifications'),
   unreadCount: () => api.get('/notifications/unread-count'),
+  stream: async () => new EventSource(
+    `${api.defaults.baseURL}/notifications/stream?${await ticketQuery()}`,
+    { withCredentials: true },
+  ),
   markRead: (id) => api.put(`/notifications/${id}/read`),
   markAllRead: () => api.put('/notifications/read-all'),
 };
@@ -105,7 +122,50 @@ export const filesApi = {
   upload: (formData) => api.post('/users/files/upload', formData, {
     headers: { 'Content-Type': 'multipart/form-data' },
   }),
+  link: (data) => api.post('/users/files/link', data),
   list: (entityType, entityId) => api.get(`/users/files/${entityType}/${entityId}`),
 };
 
+// AI assistant
+export const aiApi = {
+  chat: (message) => api.post('/ai/chat', { message }),
+  // EventSource only does GET, so read the POST response body as an SSE stream.
+  // onEvent(event, data) is called for each "token", "tool", "done" or "error" event.
+  chatStream: async (message, onEvent, signal) => {
+    const token = localStorage.getItem('token');
+    const res = await fetch(`${api.defaults.baseURL}/ai/chat/stream`, {
+      method: 'POST',
+      credentials: 'include',
+      headers: {
+        'Content-Type': 'application/json',
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify({ message }),
+      signal,
+    });
+    if (!res.ok) throw new Error(`AI stream failed: ${res.status}`);
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) !== -1) {
+        const frame = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        let event = 'message';
+        let data = '';
+        frame.split('\n').forEach((line) => {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        });
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  },
+};
+
 export default api;
@@ -20,7 +20,8 @@ export default function Chat() {
   const [allUsers, setAllUsers] = useState([]);
   const [dmOpen, setDmOpen] = useState(false);
   const messagesEndRef = useRef(null);
-  const pollRef = useRef(null);
+  const activeRef = useRef(null);
+  const afterRef = useRef(null);
 
   const loadChannels = useCallback(async () => {
     try {
@@ -33,20 +34,84 @@ export default function Chat() {
 
   useEffect(() => { loadChannels(); }, [loadChannels]);
 
-  const loadMessages = useCallback(async () => {
-    if (!activeChannel) return;
+  const appendMessages = useCallback((incoming) => {
+    setMessages((prev) => {
+      const seen = new Set(prev.map(m => m.message_id));
+      const fresh = incoming.filter(m => !seen.has(m.message_id));
+      return fresh.length ? [...prev, ...fresh] : prev;
+    });
+  }, []);
+
+  // Fetch only what arrived after the newest message we have
+  const catchUp = useCallback(async () => {
+    const channelId = activeRef.current?.channel_id;
+    if (!channelId) return;
     try {
-      const res = await chatApi.getMessages(activeChannel.channel_id);
-      setMessages(res.data);
+      // Without a cursor (the channel was empty) the latest page is fetched instead
+      const res = await chatApi.getMessages(channelId, afterRef.current ? { after: afterRef.current } : {});
+      if (activeRef.current?.channel_id !== channelId) return;
+      if (res.headers['x-after-cursor']) afterRef.current = res.headers['x-after-cursor'];
+      appendMessages(res.data);
     } catch {}
+  }, [appendMessages]);
+
+  useEffect(() => {
+    activeRef.current = activeChannel;
+    afterRef.current = null;
+    setMessages([]);
+    if (!activeChannel) return;
+    const channelId = activeChannel.channel_id;
+    chatApi.getMessages(channelId).then((res) => {
+      if (activeRef.current?.channel_id !== channelId) return;
+      afterRef.current = res.headers['x-after-cursor'] || null;
+      setMessages(res.data);
+    }).catch(() => {});
   }, [activeChannel]);
 
+  // New messages are pushed over the chat socket. Messages sent through another
+  // server process aren't, so a slow catch-up fetch covers those, and the socket
+  // reconnects (catching up on what it missed) if it drops.
   useEffect(() => {
-    loadMessages();
-    if (pollRef.current) clearInterval(pollRef.current);
-    pollRef.current = setInterval(loadMessages, 3000);
-    return () => { if (pollRef.current) clearInterval(pollRef.current); };
-  }, [loadMessages]);
+    let socket;
+    let reconnectTimer;
+    let closed = false;
+    const connect = async () => {
+      try {
+        socket = await chatApi.socket();
+      } catch {
+        if (!closed) reconnectTimer = setTimeout(connect, 3000);
+        return;
+      }
+      if (closed) {
+        socket.close();
+        return;
+      }
+      socket.onopen = () => catchUp();
+      socket.onmessage = (e) => {
+        const event = JSON.parse(e.data);
+        if (event.type === 'message' && event.message.channel_id === activeRef.current?.channel_id) {
+          appendMessages([event.message]);
+        }
+      };
+      socket.onclose = () => {
+        if (!closed) reconnectTimer = setTimeout(connect, 3000);
+      };
+    };
+    connect();
+    const heartbeat = setInterval(() => {
+      if (socket?.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: 'heartbeat', active: document.visibilityState === 'visible' }));
+      }
+    }, 30000);
+    const fallback = setInterval(catchUp, 30000);
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      clearInterval(heartbeat);
+      clearInterval(fallback);
+      socket?.close();
+    };
+  }, [appendMessages, catchUp]);
 
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -55,9 +120,9 @@ export default function Chat() {
   const sendMessage = async () => {
     if (!newMessage.trim() || !activeChannel) return;
     try {
-      await chatApi.sendMessage({ content: newMessage, channel_id: activeChannel.channel_id });
+      const res = await chatApi.sendMessage({ content: newMessage, channel_id: activeChannel.channel_id });
       setNewMessage('');
-      loadMessages();
+      appendMessages([res.data]);
     } catch {}
   };
 
@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from ai_context import KINDS  # noqa: E402
+from ai_retrieval import hint_scores, select_context  # noqa: E402
+from bench_agent import build_dataset  # noqa: E402
+
+
+def snapshot_entities(users=50, projects=20, tasks=2000) -> dict:
+    # Shaped like ContextSnapshot.entities: the bench dataset cut down to the snapshot projections
+    docs = dict(zip(("users", "projects", "tasks"), build_dataset(42, users, projects, tasks)))
+    entities = {}
+    for kind, (key, projection) in KINDS.items():
+        fields = [f for f, on in projection.items() if on]
+        entities[kind] = {d[key]: {f: d.get(f) for f in fields} for d in docs[kind]}
+    return entities
+
+
+def selected(prompt: str, entities: dict, version: int = 1) -> dict:
+    return json.loads(select_context(prompt, version, entities)["context"])
+
+
+def test_overdue_prompt_selects_overdue_tasks():
+    entities = snapshot_entities()
+    now_iso = datetime.now(timezone.utc).isoformat()
+    context = selected("Which tasks are overdue?", entities)
+    assert len(context["tasks"]) >= 10
+    assert all(t["status"] != "done" and t["due_date"] < now_iso for t in context["tasks"])
+
+
+def test_keyword_prompt_selects_matching_tasks():
+    entities = snapshot_entities()
+    context = selected("fix invoice rounding", entities)
+    assert context["tasks"]
+    assert all(
+        {"invoice", "rounding", "fix"} & set(f"{t['title']} {t.get('description', '')}".lower().split())
+        for t in context["tasks"]
+    )
+
+
+def test_hint_words_match_whole_words_only():
+    entities = snapshot_entities(tasks=200)
+    assert not hint_scores("translate the docs to the latest template", entities)
+    assert hint_scores("what is late?", entities)
+    assert hint_scores("anything due soon", entities)